@@ -9,6 +9,8 @@ from keras.optimizers import Adam
 import tensorflow as tf
 import keras.backend as K
 
+from target_update import create_target_update_ops, run_target_updates
+
 HIDDEN1_UNITS = 300
 HIDDEN2_UNITS = 600
 
@@ -28,6 +30,8 @@ class ActorNetwork(object):
         self.params_grad = tf.gradients(self.model.output, self.weights, -self.action_gradient)
         grads = zip(self.params_grad, self.weights)
         self.optimize = tf.train.AdamOptimizer(LEARNING_RATE).apply_gradients(grads)
+        self.target_soft_update, self.target_hard_update = create_target_update_ops(
+            self.weights, self.target_weights, self.TAU)
         self.sess.run(tf.initialize_all_variables())
 
     def train(self, states, action_grads):
@@ -36,12 +40,8 @@ class ActorNetwork(object):
             self.action_gradient: action_grads
         })
 
-    def target_train(self):
-        actor_weights = self.model.get_weights()
-        actor_target_weights = self.target_model.get_weights()
-        for i in xrange(len(actor_weights)):
-            actor_target_weights[i] = self.TAU * actor_weights[i] + (1 - self.TAU)* actor_target_weights[i]
-        self.target_model.set_weights(actor_target_weights)
+    def target_train(self, hard=False):
+        run_target_updates(self.sess, [self], hard)
 
     def create_actor_network(self, state_size,action_dim):
         print("Now we build the model")
@@ -0,0 +1,109 @@
+import threading
+import timeit
+import tensorflow as tf
+
+from PrioritizedReplayBuffer import PrioritizedReplayBuffer
+
+class AsyncLearner(object):
+    # Trains from the replay buffer on a background thread while the driving loop only acts and
+    # adds transitions. Acting goes through a separate copy of the actor ("policy model") that the
+    # learner refreshes from the trained actor every PUBLISH_EVERY updates under a lock, so the
+    # driving loop never sees a half-written set of weights.
+
+    def __init__(self, sess, actor, update, buff, BATCH_SIZE, UPDATE_TO_DATA=1.0, PUBLISH_EVERY=10,
+                 TARGET_COPY_STEPS=0):
+        self.sess = sess
+        self.update = update
+        self.buff = buff
+        self.BATCH_SIZE = BATCH_SIZE
+        self.UPDATE_TO_DATA = UPDATE_TO_DATA
+        self.PUBLISH_EVERY = PUBLISH_EVERY
+        self.TARGET_COPY_STEPS = TARGET_COPY_STEPS
+
+        self.policy_model = actor.create_actor_network(actor.model.input_shape[1], actor.model.output_shape[1])[0]
+        self.publish_op = tf.group(*[tf.assign(p, w) for w, p in
+                                     zip(actor.weights, self.policy_model.trainable_weights)])
+        self.sess.run(tf.initialize_variables(self.policy_model.trainable_weights))
+        self.publish()
+
+        self.buffer_lock = threading.Lock()
+        self.policy_lock = threading.Lock()
+        self.data_ready = threading.Condition(self.buffer_lock)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.running = False
+        self.error = None
+
+        self.env_steps = 0
+        self.updates = 0
+        self.loss = 0.
+        self.last_report = (timeit.default_timer(), 0, 0)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        with self.data_ready:
+            self.running = False
+            self.data_ready.notify()
+        self.thread.join()
+
+    def publish(self):
+        # Copy the trained actor into the policy model used for acting
+        self.sess.run(self.publish_op)
+
+    def act(self, states):
+        with self.policy_lock:
+            return self.policy_model.predict(states)
+
+    def add(self, state, action, reward, new_state, done):
+        if self.error is not None:
+            raise self.error
+        with self.data_ready:
+            self.buff.add(state, action, reward, new_state, done)
+            self.env_steps += 1
+            self.data_ready.notify()
+
+    def rates(self):
+        # (env steps/sec, updates/sec) since the previous call
+        now, env_steps, updates = timeit.default_timer(), self.env_steps, self.updates
+        then, last_env_steps, last_updates = self.last_report
+        self.last_report = (now, env_steps, updates)
+        elapsed = max(now - then, 1e-9)
+        return (env_steps - last_env_steps) / elapsed, (updates - last_updates) / elapsed
+
+    def run(self):
+        prioritized = isinstance(self.buff, PrioritizedReplayBuffer)
+        try:
+            while True:
+                with self.data_ready:
+                    # Keep updates/env steps at UPDATE_TO_DATA, and wait for a full first batch
+                    while self.running and (self.buff.count() < self.BATCH_SIZE or
+                                            self.updates >= self.UPDATE_TO_DATA * self.env_steps):
+                        self.data_ready.wait(0.1)
+                    if not self.running:
+                        return
+                    batch = self.buff.sample(self.BATCH_SIZE)
+
+                if prioritized:
+                    states, actions, rewards, new_states, dones, weights, indices = batch
+                else:
+                    states, actions, rewards, new_states, dones = batch
+                    weights = None
+                self.loss, td_errors = self.update.train(states, actions, rewards, new_states, dones, weights)
+                if prioritized:
+                    with self.buffer_lock:
+                        self.buff.update_priorities(indices, td_errors)
+
+                self.updates += 1
+                if not self.TARGET_COPY_STEPS:
+                    self.update.target_train()
+                elif self.updates % self.TARGET_COPY_STEPS == 0:
+                    self.update.target_train(hard=True)
+                if self.updates % self.PUBLISH_EVERY == 0:
+                    with self.policy_lock:
+                        self.publish()
+        except Exception as e:
+            self.error = e
+            raise
@@ -0,0 +1,46 @@
+from keras.models import Model
+from keras.layers import Convolution2D, Dense, Flatten, Input, Lambda
+import tensorflow as tf
+import keras.backend as K
+
+from target_update import create_target_update_ops, run_target_updates
+
+FEATURE_UNITS = 200
+
+class ConvEncoder(object):
+    # Convolutional encoder of the (channels, 64, 64) vision state, shared by the actor and the
+    # critic: both heads are the usual ActorNetwork/CriticNetwork built with
+    # state_size=feature_dim and take the encoder features as their state. It is trained through
+    # the critic loss only, and has its own target copy for the Bellman target.
+
+    def __init__(self, sess, image_shape, TAU):
+        self.sess = sess
+        self.TAU = TAU
+        self.feature_dim = FEATURE_UNITS
+
+        K.set_session(sess)
+
+        self.model, self.weights, self.state = self.create_encoder(image_shape)
+        self.target_model, self.target_weights, self.target_state = self.create_encoder(image_shape)
+        self.target_soft_update, self.target_hard_update = create_target_update_ops(
+            self.weights, self.target_weights, self.TAU)
+        self.sess.run(tf.initialize_all_variables())
+
+    def policy(self, actor):
+        # Keras model from images to actions through the encoder and the actor head, for acting
+        S = Input(shape=self.model.input_shape[1:])
+        return Model(input=S, output=actor.model(self.model(S)))
+
+    def target_train(self, hard=False):
+        run_target_updates(self.sess, [self], hard)
+
+    def create_encoder(self, image_shape):
+        print("Now we build the encoder")
+        S = Input(shape=list(image_shape))
+        x = Lambda(lambda pixels: pixels / 255.)(S)  # uint8 frames are fed as they are stored
+        c0 = Convolution2D(32, 8, 8, subsample=(4, 4), activation='relu', dim_ordering='th')(x)
+        c1 = Convolution2D(64, 4, 4, subsample=(2, 2), activation='relu', dim_ordering='th')(c0)
+        c2 = Convolution2D(64, 3, 3, activation='relu', dim_ordering='th')(c1)
+        F = Dense(FEATURE_UNITS, activation='relu')(Flatten()(c2))
+        model = Model(input=S, output=F)
+        return model, model.trainable_weights, S
@@ -10,6 +10,8 @@ from keras.optimizers import Adam
 import keras.backend as K
 import tensorflow as tf
 
+from target_update import create_target_update_ops, run_target_updates
+
 HIDDEN1_UNITS = 300
 HIDDEN2_UNITS = 600
 
@@ -27,6 +29,8 @@ class CriticNetwork(object):
         self.model, self.action, self.state = self.create_critic_network(state_size, action_size)  
         self.target_model, self.target_action, self.target_state = self.create_critic_network(state_size, action_size)  
         self.action_grads = tf.gradients(self.model.output, self.action)  #GRADIENTS for policy update
+        self.target_soft_update, self.target_hard_update = create_target_update_ops(
+            self.model.trainable_weights, self.target_model.trainable_weights, self.TAU)
         self.sess.run(tf.initialize_all_variables())
 
     def gradients(self, states, actions):
@@ -35,12 +39,25 @@ class CriticNetwork(object):
             self.action: actions
         })[0]
 
-    def target_train(self):
-        critic_weights = self.model.get_weights()
-        critic_target_weights = self.target_model.get_weights()
-        for i in xrange(len(critic_weights)):
-            critic_target_weights[i] = self.TAU * critic_weights[i] + (1 - self.TAU)* critic_target_weights[i]
-        self.target_model.set_weights(critic_target_weights)
+    def create_target_op(self, actor_target_model, GAMMA, target_state=None):
+        # Bellman target r + GAMMA * (1 - done) * Q'(s', mu'(s')), evaluated in one session call.
+        # target_state replaces the s' input, e.g. with the target encoder features in vision mode
+        self.reward = tf.placeholder(tf.float32, [None])
+        self.done = tf.placeholder(tf.float32, [None])
+        if target_state is None:
+            target_state = self.target_state
+        target_q = self.target_model([target_state, actor_target_model(target_state)])
+        self.y = tf.expand_dims(self.reward, 1) + GAMMA * tf.expand_dims(1. - self.done, 1) * target_q
+
+    def target_values(self, rewards, dones, new_states):
+        return self.sess.run(self.y, feed_dict={
+            self.target_state: new_states,
+            self.reward: rewards,
+            self.done: dones
+        })
+
+    def target_train(self, hard=False):
+        run_target_updates(self.sess, [self], hard)
 
     def create_critic_network(self, state_size,action_dim):
         print("Now we build the model")
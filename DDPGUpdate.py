@@ -0,0 +1,89 @@
+import numpy as np
+import tensorflow as tf
+import keras.backend as K
+
+from target_update import run_target_updates
+
+class DDPGUpdate(object):
+    # One graph spanning ActorNetwork and CriticNetwork that runs the critic regression, the
+    # action-gradient computation and the actor step in a single sess.run with a single feed.
+    # All gradients are taken from the current weights before either optimizer applies, so the
+    # actor step uses the critic as it was at the start of the update.
+    # With a ConvEncoder the states are images: the encoder features of the batch are computed
+    # once and shared by the critic regression, the action gradients and the actor step.
+
+    def __init__(self, sess, actor, critic, GAMMA, encoder=None):
+        self.sess = sess
+        self.actor = actor
+        self.critic = critic
+        self.encoder = encoder
+
+        K.set_session(sess)
+        existing = set(tf.all_variables())
+
+        self.action = critic.action
+        self.weights = tf.placeholder(tf.float32, [None])
+        critic_weights = critic.model.trainable_weights
+        if encoder is None:
+            self.state = actor.state
+            self.new_state = critic.target_state
+            features = self.state
+            mu = actor.model.output
+            critic.create_target_op(actor.target_model, GAMMA)
+        else:
+            self.state = encoder.state
+            self.new_state = encoder.target_state
+            features = encoder.model(self.state)
+            mu = actor.model(features)
+            critic.create_target_op(actor.target_model, GAMMA, encoder.target_model(self.new_state))
+            critic_weights = critic_weights + encoder.weights
+
+        # Critic regression on the sampled (s, a) against the in-graph Bellman target
+        q = critic.model([features, self.action])
+        self.td_error = tf.stop_gradient(critic.y) - q
+        self.loss = tf.reduce_mean(tf.expand_dims(self.weights, 1) * tf.square(self.td_error))
+        critic_grads = tf.gradients(self.loss, critic_weights)
+
+        # Actor step along dQ/da at a = mu(s), the encoder is left to the critic
+        q_mu = critic.model([tf.stop_gradient(features), mu])
+        self.action_grads = tf.gradients(q_mu, mu)[0]
+        actor_grads = tf.gradients(mu, actor.weights, -tf.stop_gradient(self.action_grads))
+
+        # Training health: mean |Q(s, a)| and the mean L2 norm of dQ/da over the batch
+        self.q_magnitude_op = tf.reduce_mean(tf.abs(q))
+        self.action_grad_norm_op = tf.reduce_mean(tf.sqrt(tf.reduce_sum(tf.square(self.action_grads), 1)))
+        health = [self.q_magnitude_op, self.action_grad_norm_op]
+
+        with tf.control_dependencies(critic_grads + actor_grads + health + [self.td_error, self.loss]):
+            self.optimize = tf.group(
+                tf.train.AdamOptimizer(critic.LEARNING_RATE).apply_gradients(zip(critic_grads, critic_weights)),
+                tf.train.AdamOptimizer(actor.LEARNING_RATE).apply_gradients(zip(actor_grads, actor.weights)))
+
+        # Only the optimizer slots are new, the network weights may already be loaded
+        self.sess.run(tf.initialize_variables(list(set(tf.all_variables()) - existing)))
+        self.ones = np.ones(0, dtype=np.float32)
+        self.q_magnitude = 0.
+        self.action_grad_norm = 0.
+
+    def target_train(self, hard=False):
+        # Soft (or hard copy) target update of both networks in one session call
+        networks = [self.actor, self.critic] + ([self.encoder] if self.encoder else [])
+        run_target_updates(self.sess, networks, hard)
+
+    def train(self, states, actions, rewards, new_states, dones, weights=None):
+        # Returns the critic loss and the per-sample TD errors, the health values of the batch
+        # are kept in q_magnitude and action_grad_norm
+        if weights is None:
+            if len(self.ones) != len(states):
+                self.ones = np.ones(len(states), dtype=np.float32)
+            weights = self.ones
+        _, loss, td_error, self.q_magnitude, self.action_grad_norm = self.sess.run(
+            [self.optimize, self.loss, self.td_error, self.q_magnitude_op, self.action_grad_norm_op], feed_dict={
+            self.state: states,
+            self.action: actions,
+            self.new_state: new_states,
+            self.critic.reward: rewards,
+            self.critic.done: dones,
+            self.weights: weights
+        })
+        return loss, td_error
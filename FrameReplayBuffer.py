@@ -0,0 +1,109 @@
+import numpy as np
+
+class FrameReplayBuffer(object):
+    # Replay storage for pixel observations that keeps every frame once, in a uint8 ring.
+    # A transition lives in the slot of the frame it leads to, so states are never stored:
+    # sample() rebuilds the stacks of the last frame_stack frames from the frame serial numbers,
+    # repeating the first frame of the episode where the history is shorter.
+    # Stacked states come out as (batch, frame_stack * channels, height, width) uint8 arrays.
+
+    def __init__(self, buffer_size, frame_stack=4, frame_shape=(3, 64, 64)):
+        self.buffer_size = buffer_size
+        self.frame_stack = frame_stack
+        self.frame_shape = tuple(frame_shape)
+        self.frames = np.zeros((buffer_size,) + self.frame_shape, dtype=np.uint8)
+        self.episode_starts = np.zeros(buffer_size, dtype=np.int64)  # Serial of the episode's first frame
+        self.transitions = np.zeros(buffer_size, dtype=np.bool_)  # False on the first frame of an episode
+        self.rewards = np.zeros(buffer_size, dtype=np.float32)
+        self.dones = np.zeros(buffer_size, dtype=np.bool_)
+        # Actions are allocated on the first add, once their shape is known
+        self.actions = None
+        self.offsets = np.arange(1 - frame_stack, 1)
+        self.erase()
+
+    def nbytes(self):
+        total = (self.frames.nbytes + self.episode_starts.nbytes + self.transitions.nbytes +
+                 self.rewards.nbytes + self.dones.nbytes)
+        if self.actions is not None:
+            total += self.actions.nbytes
+        return total
+
+    def store_frame(self, frame):
+        i = self.serial % self.buffer_size
+        if self.transitions[i]:
+            self.num_experiences -= 1
+        self.frames[i] = frame
+        self.episode_starts[i] = self.episode_start
+        self.transitions[i] = False
+        self.serial += 1
+        return i
+
+    def start_episode(self):
+        # The next add() begins a new episode, for episodes that ended without done
+        self.in_episode = False
+
+    def add(self, frame, action, reward, new_frame, done):
+        # frame and new_frame are the latest images of the state and the new state, stacked
+        # states are accepted too and only their last frame is kept.
+        # Within an episode frame is the previous new_frame and is not stored again, a frame
+        # that differs from it starts a new episode.
+        channels = self.frame_shape[0]
+        frame, new_frame = np.asarray(frame)[-channels:], np.asarray(new_frame)[-channels:]
+        if self.actions is None:
+            action = np.asarray(action)
+            self.actions = np.zeros((self.buffer_size,) + action.shape, dtype=np.float32)
+        if self.in_episode and frame.tobytes() != self.frames[(self.serial - 1) % self.buffer_size].tobytes():
+            self.in_episode = False
+        if not self.in_episode:
+            self.episode_start = self.serial
+            self.store_frame(frame)
+            self.in_episode = True
+        i = self.store_frame(new_frame)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[i] = done
+        self.transitions[i] = True
+        self.num_experiences += 1
+        if done:
+            self.in_episode = False
+
+    def stack(self, serials, starts):
+        # Frames serials-frame_stack+1 .. serials, clamped to the episode start
+        history = np.maximum(serials[:, None] + self.offsets, starts[:, None])
+        frames = self.frames[history % self.buffer_size]
+        return frames.reshape((len(serials), -1) + self.frame_shape[1:])
+
+    def sample(self, batch_size):
+        # Randomly sample batch_size transitions, returned as (states, actions, rewards, new_states, dones)
+        filled = min(self.serial, self.buffer_size)
+        oldest = self.serial - filled
+        batch_size = min(batch_size, self.num_experiences)
+        indices = np.empty(0, dtype=np.int64)
+        while len(indices) < batch_size:
+            candidates = np.random.randint(0, filled, size=2 * batch_size)
+            serials = self.serial - 1 - (self.serial - 1 - candidates) % self.buffer_size
+            # Skip episode starts and transitions whose history was already overwritten
+            history = np.maximum(serials - self.frame_stack, self.episode_starts[candidates])
+            keep = self.transitions[candidates] & (history >= oldest)
+            indices = np.concatenate([indices, candidates[keep]])
+        indices = indices[:batch_size]
+        serials = self.serial - 1 - (self.serial - 1 - indices) % self.buffer_size
+        starts = self.episode_starts[indices]
+        return self.stack(serials - 1, starts), self.actions[indices], self.rewards[indices], \
+               self.stack(serials, starts), self.dones[indices]
+
+    def getBatch(self, batch_size):
+        return self.sample(batch_size)
+
+    def size(self):
+        return self.buffer_size
+
+    def count(self):
+        return self.num_experiences
+
+    def erase(self):
+        self.num_experiences = 0
+        self.serial = 0  # Serial number of the next frame, its slot is serial % buffer_size
+        self.episode_start = 0
+        self.in_episode = False
+        self.transitions[:] = False
@@ -0,0 +1,26 @@
+import numpy as np
+
+class FrameStack(object):
+    # Fixed-size ring of the last k frames. Every frame is written twice, k slots apart, into a
+    # buffer of 2k frames, so the last k frames are always contiguous and get() returns them,
+    # oldest first, as a view without copying. The view changes with the next push().
+
+    def __init__(self, k, frame_shape=(3, 64, 64), dtype=np.uint8):
+        self.k = k
+        self.buffer = np.zeros((2 * k,) + tuple(frame_shape), dtype=dtype)
+        self.pointer = 0
+
+    def reset(self, frame):
+        # Start an episode with every slot holding its first frame
+        self.buffer[:] = frame
+        self.pointer = 0
+
+    def push(self, frame):
+        i = self.pointer
+        self.buffer[i] = frame
+        self.buffer[i + self.k] = frame
+        self.pointer = (i + 1) % self.k
+        return self.get()
+
+    def get(self):
+        return self.buffer[self.pointer:self.pointer + self.k]
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+from ReplayBuffer import ReplayBuffer
+
+MAGIC = 0x44445047      # "DDPG"
+VERSION = 1
+MAX_DIMS = 4
+
+# Header slots, stored as an int64 memory-mapped file next to the data files
+H_MAGIC, H_VERSION, H_CAPACITY, H_POINTER, H_COUNT, H_STATE_NDIM = range(6)
+H_STATE_SHAPE = H_STATE_NDIM + 1
+H_ACTION_NDIM = H_STATE_SHAPE + MAX_DIMS
+H_ACTION_SHAPE = H_ACTION_NDIM + 1
+HEADER_SIZE = H_ACTION_SHAPE + MAX_DIMS
+
+class MmapReplayBuffer(ReplayBuffer):
+    # Replay buffer whose storage lives in memory-mapped files under `path`, so its content
+    # survives restarts and can be larger than RAM. Every add writes one row in place and then
+    # moves the write cursor in the header, so the header never points at unwritten data.
+
+    def __init__(self, buffer_size, path):
+        super(MmapReplayBuffer, self).__init__(buffer_size)
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        header_file = os.path.join(path, 'header.dat')
+        if os.path.exists(header_file):
+            self.header = np.memmap(header_file, dtype=np.int64, mode='r+', shape=(HEADER_SIZE,))
+            self.load()
+        else:
+            self.header = np.memmap(header_file, dtype=np.int64, mode='w+', shape=(HEADER_SIZE,))
+            self.header[H_MAGIC] = MAGIC
+            self.header[H_VERSION] = VERSION
+            self.header[H_CAPACITY] = buffer_size
+            self.header.flush()
+
+    def load(self):
+        header = self.header
+        if header[H_MAGIC] != MAGIC or header[H_VERSION] != VERSION:
+            raise ValueError("%s is not a replay buffer directory" % self.path)
+        if header[H_CAPACITY] != self.buffer_size:
+            raise ValueError("Replay buffer in %s has capacity %d, expected %d"
+                             % (self.path, header[H_CAPACITY], self.buffer_size))
+        if header[H_STATE_NDIM] == 0:
+            return      # Created but never written to
+        state_shape = tuple(header[H_STATE_SHAPE:H_STATE_SHAPE + header[H_STATE_NDIM]])
+        action_shape = tuple(header[H_ACTION_SHAPE:H_ACTION_SHAPE + header[H_ACTION_NDIM]])
+        self.open_arrays(state_shape, action_shape, 'r+')
+        self.pointer = int(header[H_POINTER])
+        self.num_experiences = int(header[H_COUNT])
+
+    def open_arrays(self, state_shape, action_shape, mode):
+        def array(name, dtype, shape):
+            return np.memmap(os.path.join(self.path, name + '.dat'), dtype=dtype, mode=mode,
+                             shape=(self.buffer_size,) + shape)
+        self.states = array('states', np.float32, state_shape)
+        self.actions = array('actions', np.float32, action_shape)
+        self.rewards = array('rewards', np.float32, ())
+        self.new_states = array('new_states', np.float32, state_shape)
+        self.dones = array('dones', np.bool_, ())
+
+    def allocate(self, state, action):
+        state_shape = np.shape(state)
+        action_shape = np.shape(action)
+        if len(state_shape) > MAX_DIMS or len(action_shape) > MAX_DIMS:
+            raise ValueError("States and actions are limited to %d dimensions" % MAX_DIMS)
+        self.open_arrays(state_shape, action_shape, 'w+')
+        header = self.header
+        header[H_STATE_NDIM] = len(state_shape)
+        header[H_STATE_SHAPE:H_STATE_SHAPE + len(state_shape)] = state_shape
+        header[H_ACTION_NDIM] = len(action_shape)
+        header[H_ACTION_SHAPE:H_ACTION_SHAPE + len(action_shape)] = action_shape
+        header.flush()
+
+    def add(self, state, action, reward, new_state, done):
+        super(MmapReplayBuffer, self).add(state, action, reward, new_state, done)
+        self.header[H_POINTER] = self.pointer
+        self.header[H_COUNT] = self.num_experiences
+
+    def flush(self):
+        # Ask the OS to write dirty pages back, the header goes last
+        if self.states is not None:
+            for array in (self.states, self.actions, self.rewards, self.new_states, self.dones):
+                array.flush()
+        self.header.flush()
+
+    def erase(self):
+        super(MmapReplayBuffer, self).erase()
+        self.header[H_POINTER] = 0
+        self.header[H_COUNT] = 0
+        self.header.flush()
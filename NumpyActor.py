@@ -0,0 +1,111 @@
+import numpy as np
+
+QUANTIZE_MODES = (None, 'float16', 'int8')
+
+def quantize(W, mode):
+    # Storage arrays of a weight matrix at lower precision, int8 with one scale per output unit
+    if mode == 'float16':
+        return {'': W.astype(np.float16)}
+    if mode == 'int8':
+        scale = np.maximum(np.abs(W).max(axis=0), 1e-12) / 127.
+        return {'': np.round(W / scale).astype(np.int8), 'scale': scale.astype(np.float32)}
+    return {'': W}
+
+class NumpyActor(object):
+    # Pure NumPy forward pass of the ActorNetwork policy: two ReLU Dense layers followed by the
+    # Steering (tanh), Acceleration and Brake (sigmoid) heads, fused into one matrix.
+    # predict() reuses preallocated scratch buffers per batch size, so the returned array is
+    # overwritten by the next call with the same batch size.
+
+    def __init__(self, W0, b0, W1, b1, W2, b2):
+        self.params = [np.ascontiguousarray(p, dtype=np.float32) for p in (W0, b0, W1, b1, W2, b2)]
+        self.W0, self.b0, self.W1, self.b1, self.W2, self.b2 = self.params
+        self.state_size = self.W0.shape[0]
+        self.buffers = {}
+
+    @classmethod
+    def from_keras(cls, model, check_states=64, tolerance=1e-5):
+        # Walk back from the concat merge so the heads keep the Steering/Acceleration/Brake order.
+        # The export is checked against the model on check_states random states, a reordered head
+        # or a changed activation raises instead of driving with the wrong actions
+        merge = model.layers[-1]
+        heads = merge.inbound_nodes[0].inbound_layers
+        h1 = heads[0].inbound_nodes[0].inbound_layers[0]
+        h0 = h1.inbound_nodes[0].inbound_layers[0]
+        W0, b0 = h0.get_weights()
+        W1, b1 = h1.get_weights()
+        head_weights = [head.get_weights() for head in heads]
+        W2 = np.hstack([W for W, b in head_weights])
+        b2 = np.hstack([b for W, b in head_weights])
+        actor = cls(W0, b0, W1, b1, W2, b2)
+        if check_states:
+            states = np.random.RandomState(0).randn(check_states, actor.state_size).astype(np.float32)
+            error = actor.max_error(model, states)
+            if not error < tolerance:
+                raise ValueError("NumpyActor differs from the Keras actor by %g" % error)
+        return actor
+
+    def save(self, path, quantize_mode=None):
+        # quantize_mode 'float16' or 'int8' stores the weight matrices at lower precision, the
+        # biases stay float32. load() restores float32 weights, since NumPy has no faster
+        # low-precision matmul, so quantizing shrinks the file but not the compute
+        arrays = {}
+        for i, p in enumerate(self.params):
+            for suffix, array in quantize(p, quantize_mode if i % 2 == 0 else None).items():
+                arrays['arr_%d' % i + (suffix and '_' + suffix)] = array
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        params = []
+        for i in range(6):
+            p = data['arr_%d' % i].astype(np.float32)
+            if 'arr_%d_scale' % i in data.files:
+                p *= data['arr_%d_scale' % i]
+            params.append(p)
+        return cls(*params)
+
+    def quantized(self, mode):
+        # Copy of this actor with the weights rounded as save(quantize_mode=mode) stores them
+        params = []
+        for i, p in enumerate(self.params):
+            stored = quantize(p, mode if i % 2 == 0 else None)
+            params.append(stored[''].astype(np.float32) * stored.get('scale', 1.))
+        return NumpyActor(*params)
+
+    def nbytes(self, quantize_mode=None):
+        # Size of the stored parameters
+        return sum(sum(a.nbytes for a in quantize(p, quantize_mode if i % 2 == 0 else None).values())
+                   for i, p in enumerate(self.params))
+
+    def predict(self, states):
+        x = np.asarray(states, dtype=np.float32).reshape(-1, self.state_size)
+        n = x.shape[0]
+        if n not in self.buffers:
+            self.buffers[n] = (np.empty((n, self.W0.shape[1]), dtype=np.float32),
+                               np.empty((n, self.W1.shape[1]), dtype=np.float32),
+                               np.empty((n, self.W2.shape[1]), dtype=np.float32))
+        h0, h1, out = self.buffers[n]
+
+        np.dot(x, self.W0, out=h0)
+        h0 += self.b0
+        np.maximum(h0, 0, out=h0)
+        np.dot(h0, self.W1, out=h1)
+        h1 += self.b1
+        np.maximum(h1, 0, out=h1)
+        np.dot(h1, self.W2, out=out)
+        out += self.b2
+
+        # Steering is tanh, Acceleration and Brake are sigmoid
+        steer, pedals = out[:, :1], out[:, 1:]
+        np.tanh(steer, out=steer)
+        np.negative(pedals, out=pedals)
+        np.exp(pedals, out=pedals)
+        pedals += 1
+        np.reciprocal(pedals, out=pedals)
+        return out
+
+    def max_error(self, model, states):
+        # Largest absolute difference against the Keras model on the given states
+        return np.abs(self.predict(states) - model.predict(states)).max()
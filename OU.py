@@ -1,7 +1,47 @@
 import random
-import numpy as np 
+import numpy as np
 
 class OU(object):
 
     def function(self, x, mu, theta, sigma):
-        return theta * (mu - x) + sigma * np.random.randn(1)
\ No newline at end of file
+        return theta * (mu - x) + sigma * np.random.randn(1)
+
+class OUNoise(object):
+    # Vectorized OU.function over an (n_envs, action_dim) array of actions with per-dimension
+    # mu/theta/sigma, scaled by an exploration epsilon that decays on every call:
+    # noise = epsilon * (theta * (mu - a) + x), where x is a zero-mean OU state in place of the
+    # independent sigma * randn, so a theta of 1 gives back the old noise.
+    # Gaussian increments are drawn in blocks of block_size ticks.
+
+    def __init__(self, shape, mu, theta, sigma, epsilon=1.0, epsilon_decay=0.0, block_size=1000):
+        self.shape = tuple(shape)
+        self.mu = np.zeros(self.shape) + mu
+        self.theta = np.zeros(self.shape) + theta
+        self.sigma = np.zeros(self.shape) + sigma
+        self.epsilon = epsilon
+        self.epsilon_decay = epsilon_decay
+        self.block_size = block_size
+        self.index = block_size
+        self.x = np.zeros(self.shape)
+        self.noise = np.zeros(self.shape)
+
+    def reset(self, indices=None):
+        # Restart the process at zero, for every env or only the given rows
+        if indices is None:
+            self.x[...] = 0.
+        else:
+            self.x[indices] = 0.
+
+    def __call__(self, a):
+        # Noise for the policy actions a
+        if self.index == self.block_size:
+            self.block = np.random.randn(*((self.block_size,) + self.shape)) * self.sigma
+            self.index = 0
+        self.x += self.block[self.index] - self.theta * self.x
+        self.index += 1
+        np.subtract(self.mu, a, out=self.noise)
+        self.noise *= self.theta
+        self.noise += self.x
+        self.noise *= max(self.epsilon, 0)
+        self.epsilon -= self.epsilon_decay
+        return self.noise
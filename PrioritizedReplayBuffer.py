@@ -0,0 +1,105 @@
+import numpy as np
+from ReplayBuffer import ReplayBuffer
+
+class SumTree(object):
+    # Binary tree stored in a flat array: node i has children 2i and 2i+1, the root is node 1
+    # and leaf j lives at node capacity + j. Every internal node holds the sum of its children.
+
+    def __init__(self, size):
+        self.capacity = 1
+        while self.capacity < size:
+            self.capacity *= 2
+        self.depth = int(np.log2(self.capacity))
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def set(self, index, priority):
+        # Single leaf, as on every add: walk up the tree with plain ints, which beats the
+        # vectorized repair by far for one index. The running sum only needs each sibling
+        tree = self.tree
+        node = int(index) + self.capacity
+        value = float(priority)
+        tree[node] = value
+        while node > 1:
+            value += tree[node ^ 1]
+            node //= 2
+            tree[node] = value
+
+    def update(self, indices, priorities):
+        # Set leaf priorities and repair the sums above them, one tree level per vectorized step
+        if np.ndim(indices) == 0:
+            return self.set(indices, priorities)
+        nodes = np.atleast_1d(indices) + self.capacity
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        # Descend from the root for all query values at once, returns the leaf indices
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = values > left_sum
+            values -= left_sum * go_right
+            nodes = left + go_right
+        return nodes - self.capacity
+
+    def clear(self):
+        self.tree[:] = 0
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+
+    def __init__(self, buffer_size, alpha=0.6, beta=0.4, beta_increment=1e-5, epsilon=1e-6):
+        super(PrioritizedReplayBuffer, self).__init__(buffer_size)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.tree = SumTree(buffer_size)
+
+    def add(self, state, action, reward, new_state, done):
+        # New transitions get the largest priority seen so far so they are replayed at least once
+        i = self.pointer
+        super(PrioritizedReplayBuffer, self).add(state, action, reward, new_state, done)
+        self.tree.set(i, self.max_priority ** self.alpha)
+
+    def sample(self, batch_size):
+        # Stratified sampling proportional to priority, returned as
+        # (states, actions, rewards, new_states, dones, weights, indices)
+        batch_size = min(batch_size, self.num_experiences)
+        total = self.tree.total()
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        indices = self.tree.find(np.minimum(values, total * (1 - 1e-12)))
+        indices = np.minimum(indices, self.num_experiences - 1)
+
+        # Importance-sampling weights, normalised so the largest weight is 1
+        probs = self.tree.tree[indices + self.tree.capacity] / total
+        weights = (self.num_experiences * probs) ** -self.beta
+        weights = (weights / weights.max()).astype(np.float32)
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        return self.states[indices], self.actions[indices], self.rewards[indices], \
+               self.new_states[indices], self.dones[indices], weights, indices
+
+    def update_priorities(self, indices, td_errors):
+        # One call updates the whole minibatch, td_errors may have one column per critic output
+        td_errors = np.abs(np.asarray(td_errors, dtype=np.float64)).reshape(len(indices), -1).mean(axis=1)
+        priorities = td_errors + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def erase(self):
+        super(PrioritizedReplayBuffer, self).erase()
+        self.tree.clear()
+        self.max_priority = 1.0
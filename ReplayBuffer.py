@@ -1,31 +1,62 @@
-from collections import deque
-import random
+import numpy as np
 
 class ReplayBuffer(object):
 
     def __init__(self, buffer_size):
         self.buffer_size = buffer_size
         self.num_experiences = 0
-        self.buffer = deque()
+        self.pointer = 0
+        # Storage is allocated on the first add, once the state/action shapes are known
+        self.states = None
 
-    def getBatch(self, batch_size):
-        # Randomly sample batch_size examples
-        if self.num_experiences < batch_size:
-            return random.sample(self.buffer, self.num_experiences)
+    def allocate(self, state, action):
+        state = np.asarray(state)
+        action = np.asarray(action)
+        self.states = np.zeros((self.buffer_size,) + state.shape, dtype=np.float32)
+        self.actions = np.zeros((self.buffer_size,) + action.shape, dtype=np.float32)
+        self.rewards = np.zeros(self.buffer_size, dtype=np.float32)
+        self.new_states = np.zeros((self.buffer_size,) + state.shape, dtype=np.float32)
+        self.dones = np.zeros(self.buffer_size, dtype=np.bool_)
+
+    def nbytes(self):
+        # Fixed memory footprint of the preallocated storage
+        if self.states is None:
+            return 0
+        return (self.states.nbytes + self.actions.nbytes + self.rewards.nbytes +
+                self.new_states.nbytes + self.dones.nbytes)
+
+    def sample(self, batch_size):
+        # Randomly sample batch_size distinct examples, returned as (states, actions, rewards, new_states, dones)
+        n = self.num_experiences
+        batch_size = min(batch_size, n)
+        if n <= 16 * batch_size:
+            indices = np.random.choice(n, batch_size, replace=False)
         else:
-            return random.sample(self.buffer, batch_size)
+            # Duplicates are rare in a large buffer, so drawing again beats a permutation of n
+            indices = np.random.randint(0, n, size=batch_size)
+            while len(np.unique(indices)) < batch_size:
+                indices = np.random.randint(0, n, size=batch_size)
+        return self.states[indices], self.actions[indices], self.rewards[indices], \
+               self.new_states[indices], self.dones[indices]
+
+    def getBatch(self, batch_size):
+        return self.sample(batch_size)
 
     def size(self):
         return self.buffer_size
 
     def add(self, state, action, reward, new_state, done):
-        experience = (state, action, reward, new_state, done)
+        if self.states is None:
+            self.allocate(state, action)
+        i = self.pointer
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.new_states[i] = new_state
+        self.dones[i] = done
+        self.pointer = (i + 1) % self.buffer_size
         if self.num_experiences < self.buffer_size:
-            self.buffer.append(experience)
             self.num_experiences += 1
-        else:
-            self.buffer.popleft()
-            self.buffer.append(experience)
 
     def count(self):
         # if buffer is full, return buffer size
@@ -33,5 +64,5 @@ class ReplayBuffer(object):
         return self.num_experiences
 
     def erase(self):
-        self.buffer = deque()
         self.num_experiences = 0
+        self.pointer = 0
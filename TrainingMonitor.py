@@ -0,0 +1,191 @@
+import collections
+import csv
+import json
+import os
+import threading
+import timeit
+
+class TrainingMonitor(object):
+    # Per-step timing and training-health metrics of the driving loop, aggregated in memory and
+    # written by a background thread so the loop never blocks on output.
+    # A step is timed as consecutive laps: begin() starts it, every lap(phase) charges the time
+    # since the previous lap to phase, end_step() closes it. Scalars such as the critic loss are
+    # given to record(). Every FLUSH_EVERY env steps one row is written with the mean milliseconds
+    # per step of each phase and the mean of each scalar over the interval.
+    # path ending in .csv or .jsonl selects the file format, any other path is a TensorBoard log
+    # directory.
+
+    def __init__(self, path, FLUSH_EVERY=1000):
+        self.path = path
+        self.FLUSH_EVERY = FLUSH_EVERY
+        if path.endswith('.csv'):
+            self.format = 'csv'
+        elif path.endswith('.jsonl'):
+            self.format = 'jsonl'
+        else:
+            self.format = 'tensorboard'
+
+        self.rows = collections.deque()
+        self.rows_ready = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.running = True
+        self.error = None
+        self.thread.start()
+
+        self.step = 0
+        self.start_time = timeit.default_timer()
+        self.reset()
+
+    def reset(self):
+        self.times = {}     # Phase -> seconds over the interval
+        self.sums = {}      # Scalar -> (sum, count) over the interval
+        self.steps = 0
+        self.interval_start = self.last = timeit.default_timer()
+
+    def begin(self):
+        self.last = timeit.default_timer()
+
+    def lap(self, phase):
+        now = timeit.default_timer()
+        self.times[phase] = self.times.get(phase, 0.) + now - self.last
+        self.last = now
+
+    def record(self, name, value):
+        total, count = self.sums.get(name, (0., 0))
+        self.sums[name] = (total + float(value), count + 1)
+
+    def end_step(self, n=1):
+        # n env steps were taken, as with one tick of several cars
+        self.steps += n
+        self.step += n
+        if self.steps >= self.FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        # Queue one row for the interval since the previous flush
+        if self.error is not None:
+            raise self.error
+        if not self.steps and not self.sums:
+            return
+        now = timeit.default_timer()
+        steps = max(self.steps, 1)
+        row = {'step': self.step, 'time': now - self.start_time,
+               'steps_per_s': self.steps / max(now - self.interval_start, 1e-9)}
+        for phase, seconds in self.times.items():
+            row['time_%s_ms' % phase] = 1e3 * seconds / steps
+        for name, (total, count) in self.sums.items():
+            row[name] = total / count
+        with self.rows_ready:
+            self.rows.append(row)
+            self.rows_ready.notify()
+        self.reset()
+
+    def close(self):
+        self.flush()
+        with self.rows_ready:
+            self.running = False
+            self.rows_ready.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        writer = None
+        try:
+            while True:
+                with self.rows_ready:
+                    while self.running and not self.rows:
+                        self.rows_ready.wait(1.0)
+                    if not self.rows:
+                        break
+                    rows = list(self.rows)
+                    self.rows.clear()
+                if writer is None:
+                    writer = self.open_writer()
+                for row in rows:
+                    writer.write(row)
+                writer.flush()
+        except Exception as e:
+            self.error = e
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def open_writer(self):
+        if self.format == 'csv':
+            return CsvWriter(self.path)
+        if self.format == 'jsonl':
+            return JsonlWriter(self.path)
+        return TensorBoardWriter(self.path)
+
+
+class JsonlWriter(object):
+    def __init__(self, path):
+        self.f = open(path, 'a')
+
+    def write(self, row):
+        self.f.write(json.dumps(row, sort_keys=True) + '\n')
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class CsvWriter(object):
+    # A row with columns not seen before, like episode_reward after the first episode ends,
+    # rewrites the file once with the wider header, earlier rows stay blank in the new columns
+    def __init__(self, path):
+        self.path = path
+        self.fieldnames = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.fieldnames = next(csv.reader(f), [])
+        self.open()
+
+    def open(self):
+        self.f = open(self.path, 'a')
+        self.writer = csv.DictWriter(self.f, self.fieldnames, restval='')
+
+    def write(self, row):
+        new = sorted(set(row) - set(self.fieldnames))
+        if new:
+            self.extend(new)
+        self.writer.writerow(row)
+
+    def extend(self, new):
+        self.f.close()
+        with open(self.path) as f:
+            rows = list(csv.DictReader(f))
+        self.fieldnames = self.fieldnames + new
+        with open(self.path, 'w') as f:
+            writer = csv.DictWriter(f, self.fieldnames, restval='')
+            writer.writeheader()
+            writer.writerows(rows)
+        self.open()
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class TensorBoardWriter(object):
+    def __init__(self, logdir):
+        import tensorflow as tf
+        self.tf = tf
+        self.writer = tf.train.SummaryWriter(logdir)
+
+    def write(self, row):
+        values = [self.tf.Summary.Value(tag=name, simple_value=value)
+                  for name, value in sorted(row.items()) if name != 'step']
+        self.writer.add_summary(self.tf.Summary(value=values), row['step'])
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,358 @@
+"""Micro-benchmarks for the training loop hot paths, run on CPU with synthetic data.
+
+    python benchmarks.py                        # run everything
+    python benchmarks.py parser replay          # run selected benchmarks
+    python benchmarks.py --output bench.json --baseline baseline.json --threshold 0.15
+
+Every benchmark reports microseconds per call of each hot path it times. Results are written to
+--output as JSON and compared against --baseline, failing (exit status 1) when any timing is
+more than --threshold slower. --save-baseline stores the run as the new baseline. Benchmarks
+whose dependencies are missing are recorded as skipped.
+"""
+import argparse
+import json
+import platform
+import socket
+import sys
+import time
+import timeit
+import traceback
+import numpy as np
+
+STATE_DIM = 29
+ACTION_DIM = 3
+BATCH_SIZE = 32
+
+def rate(fn, steps, warmup=10):
+    # Calls per second of fn, after a few warmup calls
+    for _ in range(warmup):
+        fn()
+    start = timeit.default_timer()
+    for _ in range(steps):
+        fn()
+    return steps / (timeit.default_timer() - start)
+
+def us(fn, steps, warmup=10):
+    # Microseconds per call of fn
+    return 1e6 / rate(fn, steps, warmup)
+
+def synthetic_batch(batch_size=BATCH_SIZE, state_dim=STATE_DIM, action_dim=ACTION_DIM):
+    states = np.random.randn(batch_size, state_dim).astype(np.float32)
+    actions = np.random.uniform(-1, 1, (batch_size, action_dim)).astype(np.float32)
+    rewards = np.random.randn(batch_size).astype(np.float32)
+    new_states = np.random.randn(batch_size, state_dim).astype(np.float32)
+    dones = np.random.uniform(size=batch_size) < 0.01
+    return states, actions, rewards, new_states, dones
+
+def synthetic_datagram(vision=False):
+    # A sensor datagram in the SCR server format, with a random 64x64 RGB image for vision
+    sensors = [('angle', [0.0123]), ('curLapTime', [12.3]), ('damage', [0]), ('distFromStart', [2054.5]),
+               ('distRaced', [10.2]), ('fuel', [94]), ('gear', [2]), ('lastLapTime', [0]),
+               ('opponents', [200] * 36), ('racePos', [1]), ('rpm', [4520.3]), ('speedX', [82.1]),
+               ('speedY', [-0.3]), ('speedZ', [1e-05]), ('track', np.linspace(4, 200, 19)),
+               ('trackPos', [-0.12]), ('wheelSpinVel', [70.1, 70.2, 71, 71.5]), ('z', [0.345]),
+               ('focus', [-1] * 5)]
+    if vision:
+        sensors.insert(-1, ('img', np.random.randint(0, 256, 64 * 64 * 3)))
+    return b'(' + b')('.join(name + ' ' + ' '.join('%g' % x for x in values) for name, values in sensors) + b')\x00'
+
+def cpu_session():
+    # A fresh graph and CPU-only session for each benchmark
+    import tensorflow as tf
+    from keras import backend as K
+    tf.reset_default_graph()
+    sess = tf.Session(config=tf.ConfigProto(device_count={'GPU': 0}))
+    K.set_session(sess)
+    return sess
+
+def bench_update(steps=200):
+    # Four separate session entries per step against the fused DDPGUpdate op
+    from ActorNetwork import ActorNetwork
+    from CriticNetwork import CriticNetwork
+    from DDPGUpdate import DDPGUpdate
+
+    sess = cpu_session()
+    actor = ActorNetwork(sess, STATE_DIM, ACTION_DIM, BATCH_SIZE, 0.001, 0.0001)
+    critic = CriticNetwork(sess, STATE_DIM, ACTION_DIM, BATCH_SIZE, 0.001, 0.001)
+    update = DDPGUpdate(sess, actor, critic, 0.99)
+    states, actions, rewards, new_states, dones = synthetic_batch()
+
+    def separate():
+        y_t = critic.target_values(rewards, dones, new_states)
+        critic.model.train_on_batch([states, actions], y_t)
+        a_for_grad = actor.model.predict(states)
+        grads = critic.gradients(states, a_for_grad)
+        actor.train(states, grads)
+
+    def fused():
+        update.train(states, actions, rewards, new_states, dones)
+
+    before = rate(separate, steps)
+    after = rate(fused, steps)
+    print("update: separate calls %.1f steps/s, fused %.1f steps/s (x%.2f)" % (before, after, after / before))
+    return {'update.separate': 1e6 / before, 'update.fused': 1e6 / after}
+
+def bench_training(steps=200):
+    # Each training call on its own, as the original loop made them
+    from ActorNetwork import ActorNetwork
+    from CriticNetwork import CriticNetwork
+    from DDPGUpdate import DDPGUpdate
+
+    sess = cpu_session()
+    actor = ActorNetwork(sess, STATE_DIM, ACTION_DIM, BATCH_SIZE, 0.001, 0.0001)
+    critic = CriticNetwork(sess, STATE_DIM, ACTION_DIM, BATCH_SIZE, 0.001, 0.001)
+    update = DDPGUpdate(sess, actor, critic, 0.99)
+    states, actions, rewards, new_states, dones = synthetic_batch()
+    y_t = critic.target_values(rewards, dones, new_states)
+    grads = critic.gradients(states, actions)
+
+    results = {
+        'training.target_values': us(lambda: critic.target_values(rewards, dones, new_states), steps),
+        'training.critic_train_on_batch': us(lambda: critic.model.train_on_batch([states, actions], y_t), steps),
+        'training.actor_predict': us(lambda: actor.model.predict(states), steps),
+        'training.critic_gradients': us(lambda: critic.gradients(states, actions), steps),
+        'training.actor_train': us(lambda: actor.train(states, grads), steps),
+        'training.actor_target_train': us(actor.target_train, steps),
+        'training.critic_target_train': us(critic.target_train, steps),
+        'training.update_target_train': us(update.target_train, steps),
+    }
+    for name in sorted(results):
+        print("%s: %.1f us" % (name, results[name]))
+    return results
+
+def bench_vision_update(steps=50, frame_stack=4):
+    # Fused update and acting latency of the shared ConvEncoder actor/critic on 64x64 frames
+    from ActorNetwork import ActorNetwork
+    from CriticNetwork import CriticNetwork
+    from ConvEncoder import ConvEncoder
+    from DDPGUpdate import DDPGUpdate
+
+    sess = cpu_session()
+    encoder = ConvEncoder(sess, (3 * frame_stack, 64, 64), 0.001)
+    actor = ActorNetwork(sess, encoder.feature_dim, ACTION_DIM, BATCH_SIZE, 0.001, 0.0001)
+    critic = CriticNetwork(sess, encoder.feature_dim, ACTION_DIM, BATCH_SIZE, 0.001, 0.001)
+    update = DDPGUpdate(sess, actor, critic, 0.99, encoder)
+    policy = encoder.policy(actor)
+    shape = (BATCH_SIZE, 3 * frame_stack, 64, 64)
+    states = np.random.randint(0, 256, shape).astype(np.uint8)
+    new_states = np.random.randint(0, 256, shape).astype(np.uint8)
+    _, actions, rewards, _, dones = synthetic_batch()
+
+    def train():
+        update.train(states, actions, rewards, new_states, dones)
+        update.target_train()
+
+    updates = rate(train, steps, warmup=3)
+    act = rate(lambda: policy.predict(states[:1]), 10 * steps)
+    print("vision_update: %.1f updates/s (%.0f frames/s), acting %.2f ms/frame"
+          % (updates, updates * BATCH_SIZE, 1e3 / act))
+    return {'vision_update.train': 1e6 / updates, 'vision_update.act': 1e6 / act}
+
+def bench_policy(steps=2000):
+    # Single-state acting latency through Keras against the NumPy export
+    from ActorNetwork import ActorNetwork
+    from NumpyActor import NumpyActor
+
+    sess = cpu_session()
+    actor = ActorNetwork(sess, STATE_DIM, ACTION_DIM, BATCH_SIZE, 0.001, 0.0001)
+    policy = NumpyActor.from_keras(actor.model)
+    states = np.random.randn(1000, STATE_DIM).astype(np.float32)
+    print("policy: max abs error vs Keras %.2e" % policy.max_error(actor.model, states))
+
+    s_t = states[:1]
+    keras_us = us(lambda: actor.model.predict(s_t), steps)
+    numpy_us = us(lambda: policy.predict(s_t), steps)
+    print("policy: Keras %.1f us/call, NumPy %.1f us/call" % (keras_us, numpy_us))
+    return {'policy.keras': keras_us, 'policy.numpy': numpy_us}
+
+def bench_parser(steps=20000):
+    # Datagram to sensor values: dict parser against the fixed-layout vector parser
+    import snakeoil3_gym as snakeoil3
+
+    data = synthetic_datagram()
+    text = data.decode('ascii')
+    slow = snakeoil3.ServerState()
+    fast = snakeoil3.FastServerState()
+    slow_us = us(lambda: slow.parse_server_bytes(data), steps)
+    str_us = us(lambda: slow.parse_server_str(text), steps)
+    fast_us = us(lambda: fast.parse_server_bytes(data), steps)
+    print("parser: ServerState %.1f us (parse_server_str %.1f us), FastServerState %.1f us (x%.2f)"
+          % (slow_us, str_us, fast_us, slow_us / fast_us))
+    return {'parser.server_state': slow_us, 'parser.parse_server_str': str_us, 'parser.fast_server_state': fast_us}
+
+def bench_vision(steps=200):
+    # Vision datagram: image through destringify lists against the direct uint8 decode
+    import snakeoil3_gym as snakeoil3
+
+    data = synthetic_datagram(vision=True)
+    slow = snakeoil3.ServerState()
+    fast = snakeoil3.FastServerState(vision=True)
+
+    def slow_parse():
+        # What TorcsEnv.obs_vision_to_image_rgb does with the list
+        slow.parse_server_bytes(data)
+        img = slow.d['img']
+        np.array([np.array(img[c::3]).reshape(64, 64) for c in range(3)], dtype=np.uint8)
+
+    slow_us = us(slow_parse, steps)
+    fast_us = us(lambda: fast.parse_server_bytes(data), steps)
+    print("vision: ServerState %.1f us, FastServerState %.1f us (x%.2f)" % (slow_us, fast_us, slow_us / fast_us))
+    return {'vision.server_state': slow_us, 'vision.fast_server_state': fast_us}
+
+def bench_action(steps=20000):
+    # DriverAction dictionary to wire message
+    import snakeoil3_gym as snakeoil3
+
+    R = snakeoil3.DriverAction()
+    R.d['steer'], R.d['accel'], R.d['brake'] = 0.1234, 0.8, 0.05
+    encode_us = us(R.encode, steps)
+    repr_us = us(R.__repr__, steps)
+    print("action: DriverAction.encode %.1f us, __repr__ %.1f us" % (encode_us, repr_us))
+    return {'action.encode': encode_us, 'action.repr': repr_us}
+
+def bench_observation(steps=20000):
+    # Sensors to agent observation and state: make_observaton on the dict against the fast path
+    import snakeoil3_gym as snakeoil3
+    from gym_torcs import TorcsEnv, obs_to_state
+
+    class Client(object):
+        S = snakeoil3.FastServerState()
+
+    # No simulator: the env is built as for an externally launched TORCS and given a parsed state
+    env = TorcsEnv(manage_torcs=False)
+    env.client = Client()
+    data = synthetic_datagram()
+    env.client.S.parse_server_bytes(data)
+    slow = snakeoil3.ServerState()
+    slow.parse_server_bytes(data)
+    make_us = us(lambda: obs_to_state(env.make_observaton(slow.d)), steps)
+    update_us = us(env.update_observation, steps)
+    print("observation: make_observaton + obs_to_state %.1f us, update_observation %.1f us" % (make_us, update_us))
+    return {'observation.make_observaton': make_us, 'observation.update_observation': update_us}
+
+def bench_replay(steps=5000, buffer_size=100000):
+    # Replay add and sampled batch assembly for the uniform, prioritized and frame buffers
+    from ReplayBuffer import ReplayBuffer
+    from PrioritizedReplayBuffer import PrioritizedReplayBuffer
+    from FrameReplayBuffer import FrameReplayBuffer
+
+    results = {}
+    s, a, r, s1, d = [x[0] for x in synthetic_batch(1)]
+    for name, buff in [('uniform', ReplayBuffer(buffer_size)), ('prioritized', PrioritizedReplayBuffer(buffer_size))]:
+        for _ in range(buffer_size // 10):
+            buff.add(s, a, r, s1, d)
+        results['replay.%s_add' % name] = us(lambda: buff.add(s, a, r, s1, d), steps)
+        results['replay.%s_sample' % name] = us(lambda: buff.sample(BATCH_SIZE), steps)
+    results['replay.uniform_getBatch'] = results.pop('replay.uniform_sample')
+
+    frames = FrameReplayBuffer(10000, frame_stack=4)
+    frame = np.random.randint(0, 256, (3, 64, 64)).astype(np.uint8)
+    for i in range(2000):
+        frames.add(frame, a, r, frame, i % 500 == 499)
+    results['replay.frame_add'] = us(lambda: frames.add(frame, a, r, frame, False), steps)
+    results['replay.frame_sample'] = us(lambda: frames.sample(BATCH_SIZE), steps // 10)
+
+    for name in sorted(results):
+        print("%s: %.1f us" % (name, results[name]))
+    return results
+
+def bench_e2e(steps=2000, port=3191):
+    # Whole agent steps (receive, parse, state, NumPy policy, encode, send) against the fake
+    # SCR server in lockstep, so the cost is the client loop plus the loopback round trip
+    import snakeoil3_gym as snakeoil3
+    from fake_torcs import FakeTorcsServer
+    from NumpyActor import NumpyActor
+
+    server = FakeTorcsServer(port=port, seed=0).start()
+    rng = np.random.RandomState(0)
+    policy = NumpyActor(rng.randn(STATE_DIM, 300) * 0.1, np.zeros(300), rng.randn(300, 600) * 0.05,
+                        np.zeros(600), rng.randn(600, ACTION_DIM) * 1e-4, np.zeros(ACTION_DIM))
+    argv, sys.argv = sys.argv, sys.argv[:1]  # Client parses the command line, ours is not for it
+    try:
+        client = snakeoil3.Client(p=port, fast=True)
+    finally:
+        sys.argv = argv
+    state = np.zeros(STATE_DIM, dtype=np.float32)
+
+    def step():
+        client.get_servers_input()
+        a_t = policy.predict(client.S.state(out=state))[0]
+        client.R.d['steer'], client.R.d['accel'], client.R.d['brake'] = a_t.tolist()
+        client.respond_to_server()
+
+    try:
+        step_us = us(step, steps)
+    finally:
+        client.shutdown()
+        server.stop()
+    print("e2e: %.1f us/step (%.0f steps/s) against the fake server" % (step_us, 1e6 / step_us))
+    return {'e2e.step': step_us}
+
+BENCHMARKS = {
+    'update': bench_update,
+    'training': bench_training,
+    'policy': bench_policy,
+    'parser': bench_parser,
+    'action': bench_action,
+    'observation': bench_observation,
+    'replay': bench_replay,
+    'e2e': bench_e2e,
+    'vision': bench_vision,
+    'vision_update': bench_vision_update,
+}
+
+def compare(results, baseline, threshold):
+    # Print every timing against the baseline, returns the names that got slower than threshold
+    regressions = []
+    print("\n%-40s %12s %12s %9s" % ("benchmark", "baseline us", "now us", "change"))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        change = results[name] / baseline[name] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("%-40s %12.1f %12.1f %+8.1f%%%s" % (name, baseline[name], results[name], 100 * change, flag))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hot path micro-benchmarks")
+    parser.add_argument('names', nargs='*', help="benchmarks to run, all by default: %s" % ' '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--threshold', type=float, default=0.10, help="relative slowdown counted as a regression")
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    run = {'host': socket.gethostname(), 'python': platform.python_version(), 'numpy': np.__version__,
+           'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': {}, 'skipped': {}, 'errors': {}}
+    for name in args.names or sorted(BENCHMARKS):
+        try:
+            run['results'].update(BENCHMARKS[name]())
+        except ImportError as e:
+            print("%s: skipped (%s)" % (name, e))
+            run['skipped'][name] = str(e)
+        except Exception as e:
+            # One broken benchmark must not cost the results and the report of the others
+            traceback.print_exc()
+            print("%s: failed (%r)" % (name, e))
+            run['errors'][name] = repr(e)
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+        print("Saved baseline to %s" % args.baseline)
+    else:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+        except IOError:
+            baseline = None
+            print("No baseline at %s, run with --save-baseline to store one" % args.baseline)
+        if baseline is not None and compare(run['results'], baseline, args.threshold):
+            sys.exit(1)
+    if run['errors']:
+        sys.exit(1)
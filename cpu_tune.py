@@ -0,0 +1,124 @@
+"""Find the fastest TensorFlow thread pool sizes for training on this host's CPU.
+
+    python cpu_tune.py                              # default grid
+    python cpu_tune.py --intra 1 2 4 8 --inter 1 2 --batch-sizes 32 64 --steps 200
+
+Runs the DDPGUpdate training step (critic regression, action gradients, actor step and soft
+target update) for every intra/inter-op thread count and batch size and writes the results to
+cpu_profile.json, which ddpg.py applies to its session on later runs on the same host.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import timeit
+
+PROFILE_PATH = 'cpu_profile.json'
+STATE_DIM = 29
+ACTION_DIM = 3
+
+
+def host_key():
+    return '%s/%d' % (socket.gethostname(), multiprocessing.cpu_count())
+
+
+def time_config(intra, inter, batch_size, steps, warmup=20):
+    # Training steps per second of a fresh graph and session with the given thread pools
+    import numpy as np
+    import tensorflow as tf
+    from keras import backend as K
+    from ActorNetwork import ActorNetwork
+    from CriticNetwork import CriticNetwork
+    from DDPGUpdate import DDPGUpdate
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra, inter_op_parallelism_threads=inter,
+                            device_count={'GPU': 0})
+    with tf.Graph().as_default():
+        sess = tf.Session(config=config)
+        K.set_session(sess)
+        actor = ActorNetwork(sess, STATE_DIM, ACTION_DIM, batch_size, 0.001, 0.0001)
+        critic = CriticNetwork(sess, STATE_DIM, ACTION_DIM, batch_size, 0.001, 0.001)
+        update = DDPGUpdate(sess, actor, critic, 0.99)
+        states = np.random.randn(batch_size, STATE_DIM).astype(np.float32)
+        actions = np.random.uniform(-1, 1, (batch_size, ACTION_DIM)).astype(np.float32)
+        rewards = np.random.randn(batch_size).astype(np.float32)
+        new_states = np.random.randn(batch_size, STATE_DIM).astype(np.float32)
+        dones = np.zeros(batch_size, dtype=np.float32)
+
+        def step():
+            update.train(states, actions, rewards, new_states, dones)
+            update.target_train()
+
+        for _ in range(warmup):
+            step()
+        start = timeit.default_timer()
+        for _ in range(steps):
+            step()
+        rate = steps / (timeit.default_timer() - start)
+        sess.close()
+    return rate
+
+
+def tune(intra_threads, inter_threads, batch_sizes, steps):
+    results = []
+    for batch_size in batch_sizes:
+        for intra in intra_threads:
+            for inter in inter_threads:
+                rate = time_config(intra, inter, batch_size, steps)
+                results.append({'intra': intra, 'inter': inter, 'batch_size': batch_size,
+                                'steps_per_s': rate, 'samples_per_s': rate * batch_size})
+                print("intra %2d inter %2d batch %4d: %8.1f steps/s %10.1f samples/s"
+                      % (intra, inter, batch_size, rate, rate * batch_size))
+    by_batch_size = {}
+    for r in results:
+        best = by_batch_size.get(str(r['batch_size']))
+        if best is None or r['steps_per_s'] > best['steps_per_s']:
+            by_batch_size[str(r['batch_size'])] = r
+    return {'host': host_key(), 'results': results, 'by_batch_size': by_batch_size,
+            'best': max(results, key=lambda r: r['samples_per_s'])}
+
+
+def load_profile(path=PROFILE_PATH):
+    # The profile tuned on this host, None if there is none
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        profile = json.load(f)
+    if profile.get('host') != host_key():
+        print("Ignoring %s, it was tuned on %s" % (path, profile.get('host')))
+        return None
+    return profile
+
+
+def apply_profile(config, batch_size, path=PROFILE_PATH):
+    # Set the thread pools of a tf.ConfigProto from the profile, using the entry tuned for
+    # batch_size or else the overall fastest one. Returns the entry, None when nothing was applied
+    profile = load_profile(path)
+    if profile is None:
+        return None
+    entry = profile['by_batch_size'].get(str(batch_size), profile['best'])
+    config.intra_op_parallelism_threads = entry['intra']
+    config.inter_op_parallelism_threads = entry['inter']
+    print("CPU profile: intra_op %d inter_op %d threads (tuned at batch size %d)"
+          % (entry['intra'], entry['inter'], entry['batch_size']))
+    return entry
+
+
+if __name__ == "__main__":
+    cpus = multiprocessing.cpu_count()
+    default_intra = sorted(set([1, 2, 4, 8, 16, cpus]) & set(range(1, cpus + 1)))
+    parser = argparse.ArgumentParser(description="Tune the TensorFlow CPU thread pools for training")
+    parser.add_argument('--intra', type=int, nargs='+', default=default_intra)
+    parser.add_argument('--inter', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 64, 128])
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--output', default=PROFILE_PATH)
+    args = parser.parse_args()
+
+    profile = tune(args.intra, args.inter, args.batch_sizes, args.steps)
+    with open(args.output, 'w') as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+    best = profile['best']
+    print("Fastest: intra %(intra)d inter %(inter)d batch %(batch_size)d, %(samples_per_s).1f samples/s" % best)
+    print("Saved to %s" % args.output)
@@ -1,4 +1,6 @@
 from gym_torcs import TorcsEnv
+from vec_torcs import VecTorcsEnv
+from surrogate_torcs import SurrogateTorcsEnv
 import numpy as np
 import random
 import argparse
@@ -11,20 +13,38 @@ from keras.engine.training import collect_trainable_weights
 import json
 
 from ReplayBuffer import ReplayBuffer
+from PrioritizedReplayBuffer import PrioritizedReplayBuffer
+from MmapReplayBuffer import MmapReplayBuffer
+from FrameReplayBuffer import FrameReplayBuffer
 from ActorNetwork import ActorNetwork
 from CriticNetwork import CriticNetwork
-from OU import OU
+from ConvEncoder import ConvEncoder
+from DDPGUpdate import DDPGUpdate
+from AsyncLearner import AsyncLearner
+from NumpyActor import NumpyActor
+from OU import OUNoise
+from TrainingMonitor import TrainingMonitor
+from cpu_tune import apply_profile
 import timeit
 
-OU = OU()       #Ornstein-Uhlenbeck Process
-
 def playGame(train_indicator=0):    #1 means Train, 0 means simply Run
     BUFFER_SIZE = 100000
     BATCH_SIZE = 32
     GAMMA = 0.99
     TAU = 0.001     #Target Network HyperParameters
+    TARGET_COPY_STEPS = 0   #Copy the target networks every N steps instead of soft updates, 0 disables
     LRA = 0.0001    #Learning rate for Actor
     LRC = 0.001     #Lerning rate for Critic
+    PRIORITIZED = False     #Prioritized experience replay
+    REPLAY_PATH = None      #Directory of a persistent replay buffer kept across restarts
+    ASYNC_LEARNER = False   #Train on a background thread instead of after every env step
+    UPDATE_TO_DATA = 1.0    #Gradient updates per env step for the background learner
+    N_ENVS = 1      #Number of simulators driven in parallel, on ports 3101, 3102, ...
+    RECV_DEADLINE = None    #Seconds to wait for each observation before repeating the last action, None waits
+    DEPLOY_ACTOR = None     #Distilled/quantized actor .npz from distill_actor.py to drive with instead of actormodel.h5
+    SURROGATE = False   #Pretrain on N_ENVS cars of the in-process NumPy surrogate instead of TORCS
+    METRICS_PATH = "train_metrics.jsonl"    #Step timings and training health, .csv, .jsonl or a TensorBoard log dir
+    METRICS_EVERY = 1000    #Env steps aggregated into each metrics row
 
     action_dim = 3  #Steering/Acceleration/Brake
     state_dim = 29  #of sensors input
@@ -32,6 +52,7 @@ def playGame(train_indicator=0):    #1 means Train, 0 means simply Run
     np.random.seed(1337)
 
     vision = False
+    FRAME_STACK = 4     #Images per vision state, encoded once per batch for both actor and critic
 
     EXPLORE = 100000.
     episode_count = 2000
@@ -39,22 +60,47 @@ def playGame(train_indicator=0):    #1 means Train, 0 means simply Run
     reward = 0
     done = False
     step = 0
-    epsilon = 1
     indicator = 0
 
+    #Reject settings that do not work together before anything is launched
+    if vision and (PRIORITIZED or REPLAY_PATH or ASYNC_LEARNER or SURROGATE or DEPLOY_ACTOR):
+        raise ValueError("vision trains synchronously from the FrameReplayBuffer, unset PRIORITIZED, "
+                         "REPLAY_PATH, ASYNC_LEARNER, SURROGATE and DEPLOY_ACTOR")
+    if PRIORITIZED and REPLAY_PATH:
+        raise ValueError("PRIORITIZED and REPLAY_PATH cannot be combined, the persistent buffer samples uniformly")
+
     #Tensorflow GPU optimization
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
+    apply_profile(config, BATCH_SIZE)  #CPU thread pools from cpu_tune.py, if this host was tuned
     sess = tf.Session(config=config)
     from keras import backend as K
     K.set_session(sess)
 
+    encoder = None
+    if vision:
+        encoder = ConvEncoder(sess, (3 * FRAME_STACK, 64, 64), TAU)
+        state_dim = encoder.feature_dim
     actor = ActorNetwork(sess, state_dim, action_dim, BATCH_SIZE, TAU, LRA)
     critic = CriticNetwork(sess, state_dim, action_dim, BATCH_SIZE, TAU, LRC)
-    buff = ReplayBuffer(BUFFER_SIZE)    #Create replay buffer
+    update = DDPGUpdate(sess, actor, critic, GAMMA, encoder)
+    if vision:
+        buff = FrameReplayBuffer(BUFFER_SIZE, FRAME_STACK)
+    elif PRIORITIZED:
+        buff = PrioritizedReplayBuffer(BUFFER_SIZE)
+    elif REPLAY_PATH:
+        buff = MmapReplayBuffer(BUFFER_SIZE, REPLAY_PATH)
+    else:
+        buff = ReplayBuffer(BUFFER_SIZE)    #Create replay buffer
 
     # Generate a Torcs environment
-    env = TorcsEnv(vision=vision, throttle=True,gear_change=False)
+    if SURROGATE:
+        env = SurrogateTorcsEnv(N_ENVS, throttle=True, gear_change=False, max_steps=max_steps)
+    elif N_ENVS > 1:
+        env = VecTorcsEnv(N_ENVS, vision=vision, throttle=True, gear_change=False)
+    else:
+        env = TorcsEnv(vision=vision, throttle=True,gear_change=False, deadline=RECV_DEADLINE,
+                       frame_stack=FRAME_STACK if vision else None)
 
     #Now load the weight
     print("Now we load the weight")
@@ -63,78 +109,177 @@ def playGame(train_indicator=0):    #1 means Train, 0 means simply Run
         critic.model.load_weights("criticmodel.h5")
         actor.target_model.load_weights("actormodel.h5")
         critic.target_model.load_weights("criticmodel.h5")
+        if encoder:
+            encoder.model.load_weights("encodermodel.h5")
+            encoder.target_model.load_weights("encodermodel.h5")
         print("Weight load successfully")
     except:
         print("Cannot find the weight")
 
+    learner = None
+    if train_indicator and ASYNC_LEARNER:
+        learner = AsyncLearner(sess, actor, update, buff, BATCH_SIZE, UPDATE_TO_DATA,
+                               TARGET_COPY_STEPS=TARGET_COPY_STEPS)
+        learner.start()
+
+    #When only driving, act through the NumPy export of the actor instead of Keras
+    policy = actor.model if train_indicator else NumpyActor.from_keras(actor.model)
+    if DEPLOY_ACTOR and not train_indicator:
+        policy = NumpyActor.load(DEPLOY_ACTOR)
+    if encoder:
+        policy = encoder.policy(actor)
+
+    #Ornstein-Uhlenbeck exploration noise for Steering/Acceleration/Brake, off when only driving
+    noise = OUNoise((N_ENVS, action_dim), mu=[0.0, 0.5, -0.1], theta=[0.60, 1.00, 1.00], sigma=[0.30, 0.10, 0.05],
+                    epsilon=train_indicator, epsilon_decay=N_ENVS / EXPLORE)
+
+    monitor = TrainingMonitor(METRICS_PATH, METRICS_EVERY)
+
+    def record_health(loss):
+        monitor.record('loss', loss)
+        monitor.record('q_magnitude', update.q_magnitude)
+        monitor.record('action_grad_norm', update.action_grad_norm)
+
+    def train_step(step):
+        if PRIORITIZED:
+            states, actions, rewards, new_states, dones, weights, indices = buff.sample(BATCH_SIZE)
+        else:
+            states, actions, rewards, new_states, dones = buff.sample(BATCH_SIZE)
+            weights = None
+        monitor.lap('sample')
+        loss, td_errors = update.train(states, actions, rewards, new_states, dones, weights)
+        if PRIORITIZED:
+            buff.update_priorities(indices, td_errors)
+        monitor.lap('train')
+        if not TARGET_COPY_STEPS:
+            update.target_train()
+        elif step % TARGET_COPY_STEPS == 0:
+            update.target_train(hard=True)
+        monitor.lap('target')
+        record_health(loss)
+        return loss
+
+    def save_models():
+        print("Now we save model")
+        actor.model.save_weights("actormodel.h5", overwrite=True)
+        with open("actormodel.json", "w") as outfile:
+            json.dump(actor.model.to_json(), outfile)
+        NumpyActor.from_keras(actor.model).save("actormodel.npz")
+
+        critic.model.save_weights("criticmodel.h5", overwrite=True)
+        with open("criticmodel.json", "w") as outfile:
+            json.dump(critic.model.to_json(), outfile)
+
+        if encoder:
+            encoder.model.save_weights("encodermodel.h5", overwrite=True)
+
+        if isinstance(buff, MmapReplayBuffer):
+            buff.flush()
+
     print("TORCS Experiment Start.")
+    if N_ENVS > 1 or SURROGATE:
+        # One batched predict across all cars per tick, finished cars are reset by the workers
+        s_t = env.reset()
+        total_reward = np.zeros(N_ENVS)
+        i = 0
+        while i < episode_count:
+            monitor.begin()
+            if learner:
+                a_t_original = learner.act(s_t)
+            else:
+                a_t_original = policy.predict(s_t)
+            monitor.lap('act')
+            a_t = a_t_original + noise(a_t_original)
+            monitor.lap('noise')
+
+            s_t1, r_t, done, info = env.step(a_t)
+            monitor.lap('env')
+
+            for n in range(N_ENVS):
+                new_state = info[n]['terminal_state'] if done[n] else s_t1[n]
+                if learner:
+                    learner.add(s_t[n], a_t[n], r_t[n], new_state, done[n])
+                else:
+                    buff.add(s_t[n], a_t[n], r_t[n], new_state, done[n])
+            monitor.lap('replay_add')
+
+            if learner:
+                record_health(learner.loss)
+            elif (train_indicator):
+                for n in range(N_ENVS):
+                    train_step(step + n)
+
+            total_reward += r_t
+            s_t = s_t1
+            step += N_ENVS
+            monitor.record('reward', r_t.mean())
+            monitor.end_step(N_ENVS)
+
+            noise.reset(done)
+            finished = i
+            for n in np.flatnonzero(done):
+                print("TOTAL REWARD @ " + str(i) +"-th Episode  : Reward " + str(total_reward[n]))
+                monitor.record('episode_reward', total_reward[n])
+                total_reward[n] = 0.
+                i += 1
+            #Save every 3 episodes, at most once per tick however many cars finished on it
+            if i // 3 > finished // 3 and (train_indicator):
+                save_models()
+
+        if learner:
+            learner.stop()
+        env.end()
+        monitor.close()
+        print("Finish.")
+        return
+
     for i in range(episode_count):
 
         print("Episode : " + str(i) + " Replay Buffer " + str(buff.count()))
 
-        if np.mod(i, 3) == 0:
-            ob = env.reset(relaunch=True)   #relaunch TORCS every 3 episode because of the memory leak error
-        else:
-            ob = env.reset()
+        ob = env.reset()    #TORCS is relaunched by its supervisor once it leaked too much memory
+        if isinstance(buff, FrameReplayBuffer):
+            buff.start_episode()    #The last episode may have ended on max_steps without done
 
-        s_t = np.hstack((ob.angle, ob.track, ob.trackPos, ob.speedX, ob.speedY,  ob.speedZ, ob.wheelSpinVel/100.0, ob.rpm))
+        s_t = env.get_state()
+        noise.reset()
      
         total_reward = 0.
         for j in range(max_steps):
-            loss = 0 
-            epsilon -= 1.0 / EXPLORE
-            a_t = np.zeros([1,action_dim])
-            noise_t = np.zeros([1,action_dim])
-            
-            a_t_original = actor.model.predict(s_t.reshape(1, s_t.shape[0]))
-            noise_t[0][0] = train_indicator * max(epsilon, 0) * OU.function(a_t_original[0][0],  0.0 , 0.60, 0.30)
-            noise_t[0][1] = train_indicator * max(epsilon, 0) * OU.function(a_t_original[0][1],  0.5 , 1.00, 0.10)
-            noise_t[0][2] = train_indicator * max(epsilon, 0) * OU.function(a_t_original[0][2], -0.1 , 1.00, 0.05)
-
-            #The following code do the stochastic brake
-            #if random.random() <= 0.1:
-            #    print("********Now we apply the brake***********")
-            #    noise_t[0][2] = train_indicator * max(epsilon, 0) * OU.function(a_t_original[0][2],  0.2 , 1.00, 0.10)
-
-            a_t[0][0] = a_t_original[0][0] + noise_t[0][0]
-            a_t[0][1] = a_t_original[0][1] + noise_t[0][1]
-            a_t[0][2] = a_t_original[0][2] + noise_t[0][2]
+            monitor.begin()
+
+            if learner:
+                a_t_original = learner.act(s_t[np.newaxis])
+            else:
+                a_t_original = policy.predict(s_t[np.newaxis])
+            monitor.lap('act')
+            a_t = a_t_original + noise(a_t_original)
+            monitor.lap('noise')
 
             ob, r_t, done, info = env.step(a_t[0])
 
-            s_t1 = np.hstack((ob.angle, ob.track, ob.trackPos, ob.speedX, ob.speedY, ob.speedZ, ob.wheelSpinVel/100.0, ob.rpm))
-        
-            buff.add(s_t, a_t[0], r_t, s_t1, done)      #Add replay buffer
-            
+            s_t1 = env.get_state()
+            monitor.lap('env')
+
+            if info.get('stale'):
+                #The observation missed RECV_DEADLINE, s_t1 and r_t repeat the last step: nothing to store
+                r_t = 0.
+            elif learner:
+                learner.add(s_t, a_t[0], r_t, s_t1, done)
+            else:
+                buff.add(s_t, a_t[0], r_t, s_t1, done)      #Add replay buffer
+            if learner:
+                record_health(learner.loss)
+            monitor.lap('replay_add')
+
             #Do the batch update
-            batch = buff.getBatch(BATCH_SIZE)
-            states = np.asarray([e[0] for e in batch])
-            actions = np.asarray([e[1] for e in batch])
-            rewards = np.asarray([e[2] for e in batch])
-            new_states = np.asarray([e[3] for e in batch])
-            dones = np.asarray([e[4] for e in batch])
-            y_t = np.asarray([e[1] for e in batch])
-
-            target_q_values = critic.target_model.predict([new_states, actor.target_model.predict(new_states)])  
-           
-            for k in range(len(batch)):
-                if dones[k]:
-                    y_t[k] = rewards[k]
-                else:
-                    y_t[k] = rewards[k] + GAMMA*target_q_values[k]
-       
-            if (train_indicator):
-                loss += critic.model.train_on_batch([states,actions], y_t) 
-                a_for_grad = actor.model.predict(states)
-                grads = critic.gradients(states, a_for_grad)
-                actor.train(states, grads)
-                actor.target_train()
-                critic.target_train()
+            if (train_indicator) and not learner:
+                train_step(step)
 
             total_reward += r_t
             s_t = s_t1
-        
-            print("Episode", i, "Step", step, "Action", a_t, "Reward", r_t, "Loss", loss)
+            monitor.record('reward', r_t)
+            monitor.end_step()
         
             step += 1
             if done:
@@ -142,20 +287,25 @@ def playGame(train_indicator=0):    #1 means Train, 0 means simply Run
 
         if np.mod(i, 3) == 0:
             if (train_indicator):
-                print("Now we save model")
-                actor.model.save_weights("actormodel.h5", overwrite=True)
-                with open("actormodel.json", "w") as outfile:
-                    json.dump(actor.model.to_json(), outfile)
-
-                critic.model.save_weights("criticmodel.h5", overwrite=True)
-                with open("criticmodel.json", "w") as outfile:
-                    json.dump(critic.model.to_json(), outfile)
+                save_models()
 
         print("TOTAL REWARD @ " + str(i) +"-th Episode  : Reward " + str(total_reward))
         print("Total Step: " + str(step))
+        monitor.record('episode_reward', total_reward)
+        if learner:
+            print("Env steps/s: %.1f Updates/s: %.1f" % learner.rates())
+        if RECV_DEADLINE is not None:
+            print("Link: RTT %(rtt_mean).4fs max %(rtt_max).4fs Stale %(stale)d Dropped %(dropped)d"
+                  % env.link_stats())
+        if env.supervisor:
+            print("TORCS relaunches: %(relaunches)d RSS: %(rss)d Restart latency: %(restart_latency).2fs"
+                  % env.supervisor.metrics())
         print("")
 
+    if learner:
+        learner.stop()
     env.end()  # This is for shutting down TORCS
+    monitor.close()
     print("Finish.")
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""Distill the trained actor into narrower NumpyActor students for driving, optionally quantized,
+and report their action error against the teacher next to their speedup.
+
+    python distill_actor.py --states replay/ --sizes 32x64 64x128 150x300 --quantize float16 int8
+
+The teacher is actormodel.npz as saved by ddpg.py. States come from a persistent replay
+buffer directory (REPLAY_PATH in ddpg.py) or a .npy array of recorded states. Each student is
+saved as actormodel_<h1>x<h2>[_<quantization>].npz, to be set as DEPLOY_ACTOR in ddpg.py.
+"""
+import argparse
+import os
+import timeit
+import numpy as np
+
+from NumpyActor import NumpyActor
+from MmapReplayBuffer import MmapReplayBuffer, H_CAPACITY, HEADER_SIZE
+
+
+def load_states(path):
+    if os.path.isdir(path):
+        header = np.memmap(os.path.join(path, 'header.dat'), dtype=np.int64, mode='r', shape=(HEADER_SIZE,))
+        buff = MmapReplayBuffer(int(header[H_CAPACITY]), path)
+        return np.array(buff.states[:buff.count()])
+    return np.load(path).astype(np.float32)
+
+
+def distill(teacher, states, hidden1, hidden2, epochs=30, batch_size=256, lr=1e-3, seed=1337):
+    # Fit a hidden1/hidden2 student to the teacher's actions on states, by minibatch Adam on
+    # the squared action error
+    rng = np.random.RandomState(seed)
+    targets = teacher.predict(states).copy()
+    sizes = [states.shape[1], hidden1, hidden2, targets.shape[1]]
+    params = []
+    for i, (n_in, n_out) in enumerate(zip(sizes[:-1], sizes[1:])):
+        scale = np.sqrt(2. / n_in) if i < 2 else 1e-3
+        params += [(rng.randn(n_in, n_out) * scale).astype(np.float32), np.zeros(n_out, dtype=np.float32)]
+    m = [np.zeros_like(p) for p in params]
+    v = [np.zeros_like(p) for p in params]
+    beta1, beta2, t = 0.9, 0.999, 0
+
+    for epoch in range(epochs):
+        order = rng.permutation(len(states))
+        for start in range(0, len(states), batch_size):
+            batch = order[start:start + batch_size]
+            x, y = states[batch], targets[batch]
+            W0, b0, W1, b1, W2, b2 = params
+            h0 = np.maximum(x.dot(W0) + b0, 0)
+            h1 = np.maximum(h0.dot(W1) + b1, 0)
+            out = h1.dot(W2) + b2
+            out[:, :1] = np.tanh(out[:, :1])
+            out[:, 1:] = 1 / (1 + np.exp(-out[:, 1:]))
+
+            # Back through the Steering (tanh) and Acceleration/Brake (sigmoid) heads
+            d_out = 2 * (out - y) / len(batch)
+            d_out[:, :1] *= 1 - out[:, :1] ** 2
+            d_out[:, 1:] *= out[:, 1:] * (1 - out[:, 1:])
+            d_h1 = d_out.dot(W2.T) * (h1 > 0)
+            d_h0 = d_h1.dot(W1.T) * (h0 > 0)
+            grads = [x.T.dot(d_h0), d_h0.sum(0), h0.T.dot(d_h1), d_h1.sum(0), h1.T.dot(d_out), d_out.sum(0)]
+
+            t += 1
+            step = lr * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+            for p, g, m_p, v_p in zip(params, grads, m, v):
+                m_p *= beta1
+                m_p += (1 - beta1) * g
+                v_p *= beta2
+                v_p += (1 - beta2) * g * g
+                p -= (step * m_p / (np.sqrt(v_p) + 1e-8)).astype(np.float32)
+    return NumpyActor(*params)
+
+
+def action_error(actor, teacher_actions, states):
+    error = np.abs(actor.predict(states) - teacher_actions)
+    return error.max(), error.mean()
+
+
+def latency(actor, states, steps=2000):
+    # Seconds per single-state predict, as when driving
+    s_t = states[:1]
+    start = timeit.default_timer()
+    for _ in range(steps):
+        actor.predict(s_t)
+    return (timeit.default_timer() - start) / steps
+
+
+def report(teacher, candidates, states):
+    # candidates is a list of (name, actor, quantize_mode)
+    teacher_actions = teacher.predict(states).copy()
+    base = latency(teacher, states)
+    print("%-26s %10s %10s %10s %10s %8s" % ("model", "size KB", "max err", "mean err", "us/call", "speedup"))
+    for name, actor, mode in [('teacher', teacher, None)] + candidates:
+        max_err, mean_err = action_error(actor, teacher_actions, states)
+        t = latency(actor, states)
+        print("%-26s %10.1f %10.4f %10.4f %10.1f %8.2f"
+              % (name, actor.nbytes(mode) / 1024., max_err, mean_err, 1e6 * t, base / t))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill and quantize the actor for driving")
+    parser.add_argument('--teacher', default='actormodel.npz')
+    parser.add_argument('--states', required=True, help="replay buffer directory or .npy of states")
+    parser.add_argument('--sizes', nargs='+', default=['32x64', '64x128', '150x300'], help="hidden1xhidden2")
+    parser.add_argument('--quantize', nargs='*', default=['float16', 'int8'], choices=['float16', 'int8'])
+    parser.add_argument('--epochs', type=int, default=30)
+    args = parser.parse_args()
+
+    teacher = NumpyActor.load(args.teacher)
+    states = load_states(args.states)
+    np.random.RandomState(0).shuffle(states)
+    held_out = max(len(states) // 10, 1)
+    train_states, test_states = states[held_out:], states[:held_out]
+
+    candidates = []
+    for size in args.sizes:
+        hidden1, hidden2 = [int(n) for n in size.split('x')]
+        student = distill(teacher, train_states, hidden1, hidden2, epochs=args.epochs)
+        for mode in [None] + args.quantize:
+            name = 'actormodel_%s' % size + ('_' + mode if mode else '')
+            student.save(name + '.npz', quantize_mode=mode)
+            candidates.append((name, NumpyActor.load(name + '.npz'), mode))
+    report(teacher, candidates, test_states)
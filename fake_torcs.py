@@ -0,0 +1,264 @@
+"""Headless stand-in for a TORCS server speaking the SCR protocol, for benchmarks and
+end-to-end tests on machines without TORCS.
+
+    python fake_torcs.py --port 3101 --tick-rate 50 --packet-loss 0.01
+
+The car is simulated by KinematicTrack, a simple kinematic car-on-track model.
+"""
+import argparse
+import random
+import re
+import select
+import socket
+import threading
+import time
+import numpy as np
+
+TRACK_ANGLES = [-45, -19, -12, -7, -4, -2.5, -1.7, -1, -.5, 0, .5, 1, 1.7, 2.5, 4, 7, 12, 19, 45]
+GEAR_RPM = np.array([30., 120., 80., 60., 48., 40., 34., 30.])  # rpm per km/h, gears -1..6
+
+
+class KinematicTrack(object):
+    # Kinematic bicycle model of n cars on a closed track of constant width whose curvature
+    # varies smoothly with the distance from start. Everything is vectorized over the cars.
+    # angle follows TORCS: track heading minus car heading, so steering left (+) lowers it.
+    # trackPos is the lateral offset scaled to [-1, 1], positive on the left.
+
+    def __init__(self, n=1, length=3000., width=12., max_curvature=1/120., dt=0.02,
+                 angles=TRACK_ANGLES, seed=None):
+        self.n = n
+        self.length = length
+        self.width = width
+        self.max_curvature = max_curvature
+        self.dt = dt
+        self.rng = np.random.RandomState(seed)
+        self.set_angles(angles)
+        self.s = np.zeros(n)        # distance along the centre line [m]
+        self.y = np.zeros(n)        # lateral offset, positive left [m]
+        self.angle = np.zeros(n)    # track heading - car heading [rad]
+        self.v = np.zeros(n)        # speed [m/s]
+        self.gear = np.ones(n)
+        self.damage = np.zeros(n)
+        self.dist_raced = np.zeros(n)
+        self.time = np.zeros(n)
+        self.reset()
+
+    def set_angles(self, angles):
+        self.ray_angles = np.radians(np.asarray(angles, dtype=np.float64))
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=np.bool_)
+        k = np.count_nonzero(mask)
+        self.s[mask] = self.rng.uniform(0, self.length, k)
+        self.y[mask] = self.rng.uniform(-0.2, 0.2, k) * self.width / 2
+        self.angle[mask] = self.rng.uniform(-0.05, 0.05, k)
+        self.v[mask] = 0.
+        self.gear[mask] = 1
+        self.damage[mask] = 0.
+        self.dist_raced[mask] = 0.
+        self.time[mask] = 0.
+
+    def curvature(self, s):
+        return self.max_curvature * np.sin(2 * np.pi * 3 * s / self.length)
+
+    def step(self, steer, accel, brake, gear=None):
+        dt = self.dt
+        steer = np.clip(steer, -1, 1)
+        accel = np.clip(accel, 0, 1)
+        brake = np.clip(brake, 0, 1)
+        if gear is not None:
+            self.gear[:] = gear
+
+        v = self.v
+        a = 12. * accel - 25. * brake - 0.0004 * v * v - 0.3 * (v > 0)
+        off_track = np.abs(self.y) > self.width / 2
+        a -= 4. * off_track * v / (v + 1.)
+        v = np.maximum(v + a * dt, 0.)
+
+        yaw_rate = v / 2.6 * np.tan(0.366 * steer)
+        along = v * np.cos(self.angle)
+        self.angle += (self.curvature(self.s) * along - yaw_rate) * dt
+        self.angle = (self.angle + np.pi) % (2 * np.pi) - np.pi
+        self.y -= v * np.sin(self.angle) * dt
+        self.s = (self.s + along * dt) % self.length
+        self.dist_raced += along * dt
+        self.time += dt
+
+        # Hitting the wall a bit beyond the track edge stops the car and damages it
+        wall = self.width / 2 + 2.
+        hit = np.abs(self.y) > wall
+        self.damage += hit * (10. + 50. * v)
+        v = np.where(hit, 0.3 * v, v)
+        self.y = np.clip(self.y, -wall, wall)
+        self.v = v
+
+    def track_pos(self):
+        return self.y / (self.width / 2)
+
+    def track_sensors(self, out=None):
+        # Distance to the track edge along each range finder, -1 when the car is off the track
+        theta = self.ray_angles[None, :] - self.angle[:, None]
+        sin = np.sin(theta)
+        y = self.y[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.where(sin > 1e-6, (self.width / 2 - y) / sin,
+                            np.where(sin < -1e-6, (-self.width / 2 - y) / sin, 200.))
+        dist = np.clip(dist, 0., 200.)
+        dist[np.abs(self.y) > self.width / 2] = -1.
+        if out is not None:
+            out[:] = dist
+            return out
+        return dist
+
+    def sensors(self):
+        # The SCR sensors of car 0, in the order the server sends them
+        speed = self.v[0] * 3.6
+        wheel = self.v[0] / 0.33
+        return [
+            ('angle', [self.angle[0]]), ('curLapTime', [self.time[0]]), ('damage', [self.damage[0]]),
+            ('distFromStart', [self.s[0]]), ('distRaced', [self.dist_raced[0]]), ('fuel', [94.]),
+            ('gear', [self.gear[0]]), ('lastLapTime', [0.]), ('opponents', [200.] * 36),
+            ('racePos', [1.]), ('rpm', [800. + speed * GEAR_RPM[int(self.gear[0]) + 1]]),
+            ('speedX', [speed]), ('speedY', [0.]), ('speedZ', [0.]),
+            ('track', self.track_sensors()[0]), ('trackPos', [self.track_pos()[0]]),
+            ('wheelSpinVel', [wheel] * 4), ('z', [0.34]), ('focus', [-1.] * 5),
+        ]
+
+
+def format_sensors(sensors):
+    return ('(' + ')('.join(name + ' ' + ' '.join('%g' % x for x in values)
+                            for name, values in sensors) + ')\x00').encode('ascii')
+
+
+class FakeTorcsServer(object):
+    # UDP server answering snakeoil3_gym.Client like a TORCS SCR server: identification, one
+    # sensor datagram per tick, restart on meta and ***shutdown*** after max_steps.
+    # tick_rate=0 steps in lockstep with the client, otherwise the simulation advances at
+    # tick_rate Hz with the latest action, like TORCS does when the client is late.
+    # In lockstep a client that has not answered within lockstep_timeout seconds, as after a
+    # dropped sensor datagram, gets the next tick with its last action.
+    # Each sensor datagram is dropped with probability packet_loss.
+
+    def __init__(self, port=3101, tick_rate=0., packet_loss=0., max_steps=None, host='localhost', seed=None,
+                 lockstep_timeout=0.2):
+        self.port = port
+        self.tick_rate = tick_rate
+        self.lockstep_timeout = lockstep_timeout
+        self.packet_loss = packet_loss
+        self.max_steps = max_steps
+        self.random = random.Random(seed)
+        self.car = KinematicTrack(seed=seed)
+        self.so = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.so.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.so.bind((host, port))
+        self.client = None
+        self.action = {'steer': 0., 'accel': 0., 'brake': 0., 'gear': 1.}
+        self.running = False
+        self.thread = None
+        self.steps = 0
+        self.episodes = 0
+        self.sent = 0
+        self.dropped = 0
+        self.last_tick = time.time()
+
+    def start(self):
+        # Serve on a daemon thread, for use inside tests and benchmarks
+        self.running = True
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.so.close()
+
+    def send_sensors(self):
+        if self.packet_loss and self.random.random() < self.packet_loss:
+            self.dropped += 1
+            return
+        self.so.sendto(format_sensors(self.car.sensors()), self.client)
+        self.sent += 1
+
+    def handle(self, data, addr):
+        # Returns True when the datagram was an action for the running race
+        text = data.decode('ascii', 'replace')
+        if '(init' in text:
+            angles = re.search(r'\(init([^)]*)\)', text).group(1).split()
+            if len(angles) == 19:
+                self.car.set_angles([float(a) for a in angles])
+            self.client = addr
+            self.car.reset()
+            self.steps = 0
+            self.episodes += 1
+            self.so.sendto(b'***identified***', addr)
+            self.last_tick = time.time()
+            self.send_sensors()
+            return False
+        if self.client is None or addr != self.client:
+            return False
+        fields = dict((m.group(1), m.group(2).split()) for m in re.finditer(r'\((\w+) ([^)]*)\)', text))
+        for key in ('steer', 'accel', 'brake', 'gear'):
+            if key in fields:
+                self.action[key] = float(fields[key][0])
+        if 'meta' in fields and float(fields['meta'][0]) == 1:
+            # Race restart, the client has to identify again
+            self.client = None
+            return False
+        return True
+
+    def tick(self):
+        self.last_tick = time.time()
+        a = self.action
+        self.car.step(a['steer'], a['accel'], a['brake'], a['gear'])
+        self.steps += 1
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            self.so.sendto(b'***shutdown***', self.client)
+            self.client = None
+        else:
+            self.send_sensors()
+
+    def serve_forever(self):
+        self.running = True
+        period = 1. / self.tick_rate if self.tick_rate else None
+        next_tick = time.time()
+        while self.running:
+            timeout = 0.1
+            if self.client is not None:
+                if not period:
+                    next_tick = self.last_tick + self.lockstep_timeout
+                timeout = max(0., next_tick - time.time())
+            ready, _, _ = select.select([self.so], [], [], timeout)
+            acted = False
+            if ready:
+                data, addr = self.so.recvfrom(2 ** 17)
+                acted = self.handle(data, addr)
+            if self.client is None:
+                next_tick = time.time()
+            elif period:
+                if time.time() >= next_tick:
+                    self.tick()
+                    next_tick += period
+            elif acted or time.time() >= self.last_tick + self.lockstep_timeout:
+                self.tick()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless SCR server stand-in for TORCS")
+    parser.add_argument('--port', type=int, default=3101)
+    parser.add_argument('--tick-rate', type=float, default=0., help="Hz, 0 steps in lockstep with the client")
+    parser.add_argument('--packet-loss', type=float, default=0.)
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--lockstep-timeout', type=float, default=0.2,
+                        help="s to wait for an action in lockstep before ticking with the last one")
+    args = parser.parse_args()
+    server = FakeTorcsServer(args.port, args.tick_rate, args.packet_loss, args.max_steps, seed=args.seed,
+                             lockstep_timeout=args.lockstep_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -3,37 +3,77 @@ from gym import spaces
 import numpy as np
 # from os import path
 import snakeoil3_gym as snakeoil3
+from torcs_supervisor import TorcsSupervisor, TORCS_COMMAND, VISION_COMMAND
+from FrameStack import FrameStack
 import numpy as np
-import copy
 import collections as col
+import math
 import os
 import time
 
 
+def obs_to_state(ob):
+    # The 29-dim low-dimensional state fed to the actor and critic
+    return np.hstack((ob.angle, ob.track, ob.trackPos, ob.speedX, ob.speedY, ob.speedZ, ob.wheelSpinVel/100.0, ob.rpm))
+
+
+Observation = col.namedtuple('Observaion', ['focus',
+                                            'speedX', 'speedY', 'speedZ', 'angle', 'damage',
+                                            'opponents',
+                                            'rpm',
+                                            'track',
+                                            'trackPos',
+                                            'wheelSpinVel'])
+VisionObservation = col.namedtuple('Observaion', ['focus',
+                                                  'speedX', 'speedY', 'speedZ', 'angle',
+                                                  'opponents',
+                                                  'rpm',
+                                                  'track',
+                                                  'trackPos',
+                                                  'wheelSpinVel',
+                                                  'img'])
+
+# Positions in snakeoil3.FastServerState.v of the sensors read on every step
+SPEED_X = snakeoil3.SENSOR_OFFSETS['speedX'][0]
+WHEEL_SPIN_VEL = snakeoil3.SENSOR_OFFSETS['wheelSpinVel'][0]
+DAMAGE = snakeoil3.SENSOR_OFFSETS['damage'][0]
+ANGLE = snakeoil3.SENSOR_OFFSETS['angle'][0]
+TRACK_POS = snakeoil3.SENSOR_OFFSETS['trackPos'][0]
+
+# Observation scaling per sensor, as in make_observaton
+OBSERVATION_SCALE = {'focus': 1/200., 'speedX': 1/300., 'speedY': 1/300., 'speedZ': 1/300.,
+                     'angle': 1/3.1416, 'damage': 1., 'opponents': 1/200., 'rpm': 1/10000.,
+                     'track': 1/200., 'trackPos': 1., 'wheelSpinVel': 1.}
+
+
 class TorcsEnv:
     terminal_judge_start = 100  # If after 100 timestep still no progress, terminated
     termination_limit_progress = 5  # [km/h], episode terminates if car is running slower than this limit
     default_speed = 50
+    buffers_allocated = False  # Set by allocate_buffers() on the first fast-path observation
 
     initial_reset = True
 
-    def __init__(self, vision=False, throttle=False, gear_change=False):
+    def __init__(self, vision=False, throttle=False, gear_change=False, port=3101, manage_torcs=True, supervisor=None,
+                 deadline=None, frame_stack=None):
         self.vision = vision
         self.throttle = throttle
         self.gear_change = gear_change
+        self.port = port
+        self.manage_torcs = manage_torcs  # False when the simulator is launched outside this env
+        self.supervisor = supervisor  # Owns the simulator process when manage_torcs is set
+        if self.manage_torcs and self.supervisor is None:
+            self.supervisor = TorcsSupervisor(VISION_COMMAND if vision else TORCS_COMMAND, port=port)
+        self.deadline = deadline  # [s] to wait for each observation before repeating the last action
+        self.fast = not vision  # Read the fixed sensor vector directly and reuse the observation buffers
+        self.frames = FrameStack(frame_stack) if vision and frame_stack else None  # Last frame_stack images
+        self.allocations = 0  # Arrays created on the step/get_state path, see count_allocations()
 
         self.initial_run = True
 
         ##print("launch torcs")
-        os.system('pkill torcs')
-        time.sleep(0.5)
-        if self.vision is True:
-            os.system('torcs -nofuel -nodamage -nolaptime -vision &')
-        else:
-            os.system('torcs -nofuel -nolaptime &')
-        time.sleep(0.5)
-        os.system('sh autostart.sh')
-        time.sleep(0.5)
+        if self.manage_torcs:
+            self.supervisor.launch()
 
         """
         # Modify here if you use multiple tracks in the environment
@@ -64,81 +104,91 @@ class TorcsEnv:
         # convert thisAction to the actual torcs actionstr
         client = self.client
 
-        this_action = self.agent_to_torcs(u)
+        # Read the sensors used below as plain scalars, straight from the parsed vector if possible
+        if self.fast:
+            v = client.S.v
+            speedX = v[SPEED_X]
+            wheel_slip = (v[WHEEL_SPIN_VEL+2]+v[WHEEL_SPIN_VEL+3]) - (v[WHEEL_SPIN_VEL]+v[WHEEL_SPIN_VEL+1])
+            # Save the privious damage from torcs for the reward calculation
+            damage_pre = v[DAMAGE]
+        else:
+            speedX = client.S.d['speedX']
+            wheelSpinVel = client.S.d['wheelSpinVel']
+            wheel_slip = (wheelSpinVel[2]+wheelSpinVel[3]) - (wheelSpinVel[0]+wheelSpinVel[1])
+            damage_pre = client.S.d['damage']
 
         # Apply Action
         action_torcs = client.R.d
 
         # Steering
-        action_torcs['steer'] = this_action['steer']  # in [-1, 1]
+        action_torcs['steer'] = u[0]  # in [-1, 1]
 
         #  Simple Autnmatic Throttle Control by Snakeoil
         if self.throttle is False:
             target_speed = self.default_speed
-            if client.S.d['speedX'] < target_speed - (client.R.d['steer']*50):
-                client.R.d['accel'] += .01
+            if speedX < target_speed - (action_torcs['steer']*50):
+                action_torcs['accel'] += .01
             else:
-                client.R.d['accel'] -= .01
+                action_torcs['accel'] -= .01
 
-            if client.R.d['accel'] > 0.2:
-                client.R.d['accel'] = 0.2
+            if action_torcs['accel'] > 0.2:
+                action_torcs['accel'] = 0.2
 
-            if client.S.d['speedX'] < 10:
-                client.R.d['accel'] += 1/(client.S.d['speedX']+.1)
+            if speedX < 10:
+                action_torcs['accel'] += 1/(speedX+.1)
 
             # Traction Control System
-            if ((client.S.d['wheelSpinVel'][2]+client.S.d['wheelSpinVel'][3]) -
-               (client.S.d['wheelSpinVel'][0]+client.S.d['wheelSpinVel'][1]) > 5):
+            if wheel_slip > 5:
                 action_torcs['accel'] -= .2
         else:
-            action_torcs['accel'] = this_action['accel']
-            action_torcs['brake'] = this_action['brake']
+            action_torcs['accel'] = u[1]
+            action_torcs['brake'] = u[2]
 
         #  Automatic Gear Change by Snakeoil
         if self.gear_change is True:
-            action_torcs['gear'] = this_action['gear']
+            action_torcs['gear'] = int(u[3])
         else:
             #  Automatic Gear Change by Snakeoil is possible
             action_torcs['gear'] = 1
             if self.throttle:
-                if client.S.d['speedX'] > 50:
+                if speedX > 50:
                     action_torcs['gear'] = 2
-                if client.S.d['speedX'] > 80:
+                if speedX > 80:
                     action_torcs['gear'] = 3
-                if client.S.d['speedX'] > 110:
+                if speedX > 110:
                     action_torcs['gear'] = 4
-                if client.S.d['speedX'] > 140:
+                if speedX > 140:
                     action_torcs['gear'] = 5
-                if client.S.d['speedX'] > 170:
+                if speedX > 170:
                     action_torcs['gear'] = 6
-        # Save the privious full-obs from torcs for the reward calculation
-        obs_pre = copy.deepcopy(client.S.d)
 
         # One-Step Dynamics Update #################################
         # Apply the Agent's action into torcs
         client.respond_to_server()
-        # Get the response of TORCS
-        client.get_servers_input()
-
-        # Get the current full-observation from torcs
-        obs = client.S.d
+        # Get the response of TORCS, in deadline mode False when it did not arrive in time and the
+        # sensors below are still those of the previous step
+        stale = client.get_servers_input() is False
 
         # Make an obsevation from a raw observation vector from TORCS
-        self.observation = self.make_observaton(obs)
+        if self.fast:
+            self.update_observation()
+            angle, trackPos, sp, damage = v[ANGLE], v[TRACK_POS], v[SPEED_X], v[DAMAGE]
+        else:
+            obs = client.S.d
+            self.observation = self.make_observaton(obs)
+            self.count_allocations(len(self.observation))
+            if self.frames and not stale:
+                self.frames.push(self.observation.img)
+            angle, trackPos, sp, damage = obs['angle'], obs['trackPos'], obs['speedX'], obs['damage']
 
         # Reward setting Here #######################################
         # direction-dependent positive reward
-        track = np.array(obs['track'])
-        trackPos = np.array(obs['trackPos'])
-        sp = np.array(obs['speedX'])
-        damage = np.array(obs['damage'])
-        rpm = np.array(obs['rpm'])
-
-        progress = sp*np.cos(obs['angle']) - np.abs(sp*np.sin(obs['angle'])) - sp * np.abs(obs['trackPos'])
+        cos_angle = math.cos(angle)
+        progress = sp*cos_angle - abs(sp*math.sin(angle)) - sp * abs(trackPos)
         reward = progress
 
         # collision detection
-        if obs['damage'] - obs_pre['damage'] > 0:
+        if damage - damage_pre > 0:
             reward = -1
 
         # Termination judgement #########################
@@ -154,7 +204,7 @@ class TorcsEnv:
         #        episode_terminate = True
         #        client.R.d['meta'] = True
 
-        if np.cos(obs['angle']) < 0: # Episode is terminated if the agent runs backward
+        if cos_angle < 0: # Episode is terminated if the agent runs backward
             episode_terminate = True
             client.R.d['meta'] = True
 
@@ -165,7 +215,7 @@ class TorcsEnv:
 
         self.time_step += 1
 
-        return self.get_obs(), reward, client.R.d['meta'], {}
+        return self.get_obs(), reward, client.R.d['meta'], {'stale': stale}
 
     def reset(self, relaunch=False):
         #print("Reset")
@@ -176,20 +226,30 @@ class TorcsEnv:
             self.client.R.d['meta'] = True
             self.client.respond_to_server()
 
-            ## TENTATIVE. Restarting TORCS every episode suffers the memory leak bug!
-            if relaunch is True:
-                self.reset_torcs()
-                print("### TORCS is RELAUNCHED ###")
+            # TORCS leaks memory across restarts, the supervisor relaunches it once it grew too much
+            if self.manage_torcs:
+                if relaunch is True:
+                    self.reset_torcs()
+                    print("### TORCS is RELAUNCHED ###")
+                elif self.supervisor.check():
+                    print("### TORCS is RELAUNCHED ###")
 
         # Modify here if you use multiple tracks in the environment
-        self.client = snakeoil3.Client(p=3101, vision=self.vision)  # Open new UDP in vtorcs
+        on_timeout = self.supervisor.unresponsive if self.manage_torcs else None
+        self.client = snakeoil3.Client(p=self.port, vision=self.vision, fast=True,
+                                       on_timeout=on_timeout, deadline=self.deadline)  # Open new UDP in vtorcs
         self.client.MAX_STEPS = np.inf
 
         client = self.client
         client.get_servers_input()  # Get the initial input from torcs
 
-        obs = client.S.d  # Get the current full-observation from torcs
-        self.observation = self.make_observaton(obs)
+        if self.fast:
+            self.update_observation()
+        else:
+            obs = client.S.d  # Get the current full-observation from torcs
+            self.observation = self.make_observaton(obs)
+            if self.frames:
+                self.frames.reset(self.observation.img)
 
         self.last_u = None
 
@@ -197,37 +257,71 @@ class TorcsEnv:
         return self.get_obs()
 
     def end(self):
-        os.system('pkill torcs')
+        if self.manage_torcs:
+            self.supervisor.close()
 
     def get_obs(self):
         return self.observation
 
+    def get_frames(self):
+        # The last frame_stack images, oldest first, as a (frame_stack, 3, 64, 64) view
+        return self.frames.get()
+
+    def link_stats(self):
+        # Latency, stale and dropped datagram counts of the current episode (deadline mode)
+        return self.client.stats.as_dict()
+
+    def get_state(self):
+        # The 29-dim agent state. On the fast path it lives in one of two buffers that alternate
+        # between steps, so it stays valid until the step after next
+        if self.fast:
+            return self.state
+        if self.frames:
+            # Vision with a frame stack: the last frames as one (frame_stack * 3, 64, 64) image,
+            # copied since the ring view moves on the next step
+            self.count_allocations(1)
+            return self.frames.get().reshape((-1, 64, 64)).copy()
+        self.count_allocations(1)
+        return obs_to_state(self.observation)
+
+    def count_allocations(self, n):
+        # Every site on the step/get_state path that creates arrays reports them here. On the
+        # fast path the count stays put once the buffers exist, so a test can assert that
+        # allocations is unchanged across step() and get_state()
+        self.allocations += n
+
+    def allocate_buffers(self):
+        size = snakeoil3.SENSOR_SIZE
+        self.observation_buffer = np.zeros(size, dtype=np.float32)
+        self.observation_scale = np.ones(size, dtype=np.float32)
+        views = {}
+        for name in Observation._fields:
+            start, n = snakeoil3.SENSOR_OFFSETS[name]
+            self.observation_scale[start:start+n] = OBSERVATION_SCALE[name]
+            views[name] = self.observation_buffer[start:start+n]
+        # The namedtuple holds views into observation_buffer, so it is built only once
+        self.observation = Observation(**views)
+        self.state_buffers = [np.zeros(29, dtype=np.float32), np.zeros(29, dtype=np.float32)]
+        self.state_flip = 0
+        self.count_allocations(4)
+        self.buffers_allocated = True
+
+    def update_observation(self):
+        S = self.client.S
+        if not self.buffers_allocated:
+            self.allocate_buffers()
+        np.multiply(S.v, self.observation_scale, out=self.observation_buffer)
+        self.state_flip ^= 1
+        self.state = self.state_buffers[self.state_flip]
+        S.state(out=self.state)
+
     def reset_torcs(self):
        #print("relaunch torcs")
-        os.system('pkill torcs')
-        time.sleep(0.5)
-        if self.vision is True:
-            os.system('torcs -nofuel -nodamage -nolaptime -vision &')
-        else:
-            os.system('torcs -nofuel -nolaptime &')
-        time.sleep(0.5)
-        os.system('sh autostart.sh')
-        time.sleep(0.5)
-
-    def agent_to_torcs(self, u):
-        torcs_action = {'steer': u[0]}
-
-        if self.throttle is True:  # throttle action is enabled
-            torcs_action.update({'accel': u[1]})
-            torcs_action.update({'brake': u[2]})
-
-        if self.gear_change is True: # gear change action is enabled
-            torcs_action.update({'gear': int(u[3])})
-
-        return torcs_action
-
+        self.supervisor.relaunch()
 
     def obs_vision_to_image_rgb(self, obs_image_vec):
+        if isinstance(obs_image_vec, np.ndarray):
+            return obs_image_vec  # Already decoded into (3, 64, 64) uint8 by FastServerState
         image_vec =  obs_image_vec
         r = image_vec[0:len(image_vec):3]
         g = image_vec[1:len(image_vec):3]
@@ -241,14 +335,6 @@ class TorcsEnv:
 
     def make_observaton(self, raw_obs):
         if self.vision is False:
-            names = ['focus',
-                     'speedX', 'speedY', 'speedZ', 'angle', 'damage',
-                     'opponents',
-                     'rpm',
-                     'track', 
-                     'trackPos',
-                     'wheelSpinVel']
-            Observation = col.namedtuple('Observaion', names)
             return Observation(focus=np.array(raw_obs['focus'], dtype=np.float32)/200.,
                                speedX=np.array(raw_obs['speedX'], dtype=np.float32)/300.0,
                                speedY=np.array(raw_obs['speedY'], dtype=np.float32)/300.0,
@@ -261,23 +347,14 @@ class TorcsEnv:
                                trackPos=np.array(raw_obs['trackPos'], dtype=np.float32)/1.,
                                wheelSpinVel=np.array(raw_obs['wheelSpinVel'], dtype=np.float32))
         else:
-            names = ['focus',
-                     'speedX', 'speedY', 'speedZ', 'angle',
-                     'opponents',
-                     'rpm',
-                     'track',
-                     'trackPos',
-                     'wheelSpinVel',
-                     'img']
-            Observation = col.namedtuple('Observaion', names)
-
             # Get RGB from observation
-            image_rgb = self.obs_vision_to_image_rgb(raw_obs[names[8]])
+            image_rgb = self.obs_vision_to_image_rgb(raw_obs['img'])
 
-            return Observation(focus=np.array(raw_obs['focus'], dtype=np.float32)/200.,
+            return VisionObservation(focus=np.array(raw_obs['focus'], dtype=np.float32)/200.,
                                speedX=np.array(raw_obs['speedX'], dtype=np.float32)/self.default_speed,
                                speedY=np.array(raw_obs['speedY'], dtype=np.float32)/self.default_speed,
                                speedZ=np.array(raw_obs['speedZ'], dtype=np.float32)/self.default_speed,
+                               angle=np.array(raw_obs['angle'], dtype=np.float32)/3.1416,
                                opponents=np.array(raw_obs['opponents'], dtype=np.float32)/200.,
                                rpm=np.array(raw_obs['rpm'], dtype=np.float32),
                                track=np.array(raw_obs['track'], dtype=np.float32)/200.,
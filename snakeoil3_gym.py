@@ -59,11 +59,39 @@ import socket
 import sys
 import getopt
 import os
+import operator
+import select
+import string
 import time
+import numpy as np
 PI= 3.14159265359
 
 data_size = 2**17
 
+# This string establishes track sensor angles! You can customize them.
+#TRACK_ANGLES= "-90 -75 -60 -45 -30 -20 -15 -10 -5 0 5 10 15 20 30 45 60 75 90"
+# xed- Going to try something a bit more aggressive...
+TRACK_ANGLES= u"-45 -19 -12 -7 -4 -2.5 -1.7 -1 -.5 0 .5 1 1.7 2.5 4 7 12 19 45"
+
+# Fixed layout of the FastServerState vector, in the order the SCR server sends the sensors
+SENSOR_LAYOUT= [
+    (u'angle', 1), (u'curLapTime', 1), (u'damage', 1), (u'distFromStart', 1),
+    (u'distRaced', 1), (u'fuel', 1), (u'gear', 1), (u'lastLapTime', 1),
+    (u'opponents', 36), (u'racePos', 1), (u'rpm', 1), (u'speedX', 1),
+    (u'speedY', 1), (u'speedZ', 1), (u'track', 19), (u'trackPos', 1),
+    (u'wheelSpinVel', 4), (u'z', 1), (u'focus', 5),
+    ]
+SENSOR_OFFSETS= dict()
+SENSOR_SIZE= 0
+for _name,_n in SENSOR_LAYOUT:
+    SENSOR_OFFSETS[_name]= (SENSOR_SIZE, _n)
+    SENSOR_SIZE+= _n
+# The 29-dim agent state (see gym_torcs.obs_to_state) as (sensor, scale) pairs
+STATE_LAYOUT= [
+    (u'angle', 1/3.1416), (u'track', 1/200.), (u'trackPos', 1.), (u'speedX', 1/300.),
+    (u'speedY', 1/300.), (u'speedZ', 1/300.), (u'wheelSpinVel', 1/100.), (u'rpm', 1/10000.),
+    ]
+
 # Initialize help messages
 ophelp=  u'Options:\n'
 ophelp+= u' --host, -H <host>    TORCS server host. [localhost]\n'
@@ -117,10 +145,39 @@ def bargraph(x,mn,mx,w,c=u'X'):
     pnc= int(posnonpu/upw)*u'_'
     return u'[%s]' % (nnc+npc+ppc+pnc)
 
+class LinkStats(object):
+    u'''Receive statistics of a Client in deadline mode.
+    rtt is the time from sending an action to getting the next observation.'''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.received= 0
+        self.stale= 0   # Datagrams skipped because a newer one was queued
+        self.dropped= 0 # Steps past the deadline, the last action was repeated
+        self.rtt= 0.
+        self.rtt_total= 0.
+        self.rtt_max= 0.
+
+    def record(self, rtt):
+        self.received+= 1
+        self.rtt= rtt
+        self.rtt_total+= rtt
+        if rtt > self.rtt_max: self.rtt_max= rtt
+
+    def as_dict(self):
+        return {u'received': self.received, u'stale': self.stale, u'dropped': self.dropped,
+                u'rtt': self.rtt, u'rtt_mean': self.rtt_total / max(self.received, 1),
+                u'rtt_max': self.rtt_max}
+
 class Client(object):
-    def __init__(self,H=None,p=None,i=None,e=None,t=None,s=None,d=None,vision=False):
+    def __init__(self,H=None,p=None,i=None,e=None,t=None,s=None,d=None,vision=False,fast=False,on_timeout=None,deadline=None):
         # If you don't like the option defaults,  change them here.
         self.vision = vision
+        self.on_timeout= on_timeout # Called instead of relaunching torcs when the server stays silent
+        self.deadline= deadline # [s] after an action to wait for the observation, None waits forever
+        self.stats= LinkStats()
+        self.sent_at= time.time()
 
         self.host= u'localhost'
         self.port= 3001
@@ -138,7 +195,8 @@ class Client(object):
         if t: self.trackname= t
         if s: self.stage= s
         if d: self.debug= d
-        self.S= ServerState()
+        if fast: self.S= FastServerState(vision=vision)
+        else: self.S= ServerState()
         self.R= DriverAction()
         self.setup_connection()
 
@@ -154,12 +212,7 @@ class Client(object):
 
         n_fail = 5
         while True:
-            # This string establishes track sensor angles! You can customize them.
-            #a= "-90 -75 -60 -45 -30 -20 -15 -10 -5 0 5 10 15 20 30 45 60 75 90"
-            # xed- Going to try something a bit more aggressive...
-            a= u"-45 -19 -12 -7 -4 -2.5 -1.7 -1 -.5 0 .5 1 1.7 2.5 4 7 12 19 45"
-
-            initmsg=u'%s(init %s)' % (self.sid,a)
+            initmsg=u'%s(init %s)' % (self.sid,TRACK_ANGLES)
 
             try:
                 self.so.sendto(initmsg.encode(), (self.host, self.port))
@@ -172,23 +225,16 @@ class Client(object):
             except socket.error, emsg:
                 print u"Waiting for server on %d............" % self.port
                 print u"Count Down : " + unicode(n_fail)
-                if n_fail < 0:
-                    print u"relaunch torcs"
-                    os.system(u'pkill torcs')
-                    time.sleep(1.0)
-                    if self.vision is False:
-                        os.system(u'torcs -nofuel -nodamage -nolaptime &')
-                    else:
-                        os.system(u'torcs -nofuel -nodamage -nolaptime -vision &')
-
-                    time.sleep(1.0)
-                    os.system(u'sh autostart.sh')
+                # Only the owner of the simulator may restart it, without one keep waiting
+                if n_fail < 0 and self.on_timeout:
+                    self.on_timeout()
                     n_fail = 5
                 n_fail -= 1
 
             identify = u'***identified***'
             if identify in sockdata:
                 print u"Client connected on %d.............." % self.port
+                self.sent_at= time.time()
                 break
 
     def parse_the_command_line(self):
@@ -235,26 +281,27 @@ class Client(object):
     def get_servers_input(self):
         u'''Server's input is stored in a ServerState object'''
         if not self.so: return
+        if self.deadline is not None:
+            return self.get_latest_input()
         sockdata= unicode()
 
         while True:
             try:
                 # Receive server data
                 sockdata,addr= self.so.recvfrom(data_size)
-                sockdata = sockdata.decode(u'utf-8')
             except socket.error, emsg:
                 print u'.',
                 #print "Waiting for data on %d.............." % self.port
-            if u'***identified***' in sockdata:
+            if b'***identified***' in sockdata:
                 print u"Client connected on %d.............." % self.port
                 continue
-            elif u'***shutdown***' in sockdata:
+            elif b'***shutdown***' in sockdata:
                 print ((u"Server has stopped the race on %d. "+
                         u"You were in %d place.") %
                         (self.port,self.S.d[u'racePos']))
                 self.shutdown()
                 return
-            elif u'***restart***' in sockdata:
+            elif b'***restart***' in sockdata:
                 # What do I do here?
                 print u"Server has restarted the race on %d." % self.port
                 # I haven't actually caught the server doing this.
@@ -263,17 +310,48 @@ class Client(object):
             elif not sockdata: # Empty?
                 continue       # Try again.
             else:
-                self.S.parse_server_str(sockdata)
+                self.S.parse_server_bytes(sockdata)
                 if self.debug:
                     sys.stderr.write(u"\x1b[2J\x1b[H") # Clear for steady output.
                     print self.S
                 break # Can now return from this function.
 
+    def get_latest_input(self):
+        u'''Deadline mode of get_servers_input. Drains the socket and parses only
+        the newest observation, waiting at most self.deadline after the last
+        action went out. Returns False when nothing arrived in time: the last
+        action is sent again and S keeps the previous observation.'''
+        end= self.sent_at + self.deadline
+        latest= None
+        while True:
+            timeout= 0. if latest else max(0., end - time.time())
+            ready,_,_= select.select([self.so], [], [], timeout)
+            if not ready: break
+            try:
+                sockdata,addr= self.so.recvfrom(data_size)
+            except socket.error, emsg:
+                break
+            if b'***shutdown***' in sockdata or b'***restart***' in sockdata:
+                print u"Server has stopped the race on %d." % self.port
+                self.shutdown()
+                return False
+            elif not sockdata or b'***identified***' in sockdata:
+                continue
+            if latest: self.stats.stale+= 1
+            latest= sockdata
+        if not latest:
+            self.stats.dropped+= 1
+            self.respond_to_server()
+            return False
+        self.stats.record(time.time() - self.sent_at)
+        self.S.parse_server_bytes(latest)
+        return True
+
     def respond_to_server(self):
         if not self.so: return
+        self.sent_at= time.time()
         try:
-            message = repr(self.R)
-            self.so.sendto(message.encode(), (self.host, self.port))
+            self.so.sendto(self.R.encode(), (self.host, self.port))
         except socket.error, emsg:
             print u"Error sending to server: %s Message %s" % (emsg[1],unicode(emsg[0]))
             sys.exit(-1)
@@ -289,6 +367,96 @@ class Client(object):
         self.so = None
         #sys.exit() # No need for this really.
 
+class MultiClient(object):
+    u'''Drives several TORCS servers from one process without threads.
+    Each server gets its own non-blocking UDP socket and select() waits
+    on all of them at once, so one inference loop can serve a fleet:
+    |    C= snakeoil.MultiClient([3101, 3102, 3103])
+    |    while C.active():
+    |        C.get_servers_input()    # Every car's S is fresh now.
+    |        for S,R in zip(C.S, C.R): drive(S,R)
+    |        C.respond_to_servers()   # All actions go out in one tick.
+    |    C.shutdown()'''
+    def __init__(self,ports,H=u'localhost',i=u'SCR',vision=False,fast=True,timeout=1.0):
+        self.host= H
+        self.ports= list(ports)
+        self.sid= i
+        self.vision= vision
+        self.timeout= timeout
+        n= len(self.ports)
+        if fast: self.S= [FastServerState(vision=vision) for _ in range(n)]
+        else: self.S= [ServerState() for _ in range(n)]
+        self.R= [DriverAction() for _ in range(n)]
+        self.so= [None]*n
+        self.setup_connections()
+
+    def setup_connections(self):
+        for k in range(len(self.ports)):
+            self.so[k]= socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.so[k].setblocking(0)
+        initmsg= (u'%s(init %s)' % (self.sid,TRACK_ANGLES)).encode()
+        waiting= set(range(len(self.ports)))
+        while waiting:
+            for k in waiting:
+                self.so[k].sendto(initmsg, (self.host, self.ports[k]))
+            ready,_,_= select.select([self.so[k] for k in waiting], [], [], self.timeout)
+            if not ready:
+                print u"Waiting for servers on %s............" % sorted(self.ports[k] for k in waiting)
+            for k in list(waiting):
+                if self.so[k] not in ready: continue
+                while True:
+                    try:
+                        sockdata,addr= self.so[k].recvfrom(data_size)
+                    except socket.error, emsg:
+                        break
+                    if b'***identified***' in sockdata:
+                        print u"Client connected on %d.............." % self.ports[k]
+                        waiting.discard(k)
+                        break # Leave the first observation queued.
+
+    def recv_latest(self, k):
+        u'''Read everything queued on socket k and return the newest datagram.'''
+        sockdata= None
+        while True:
+            try:
+                sockdata,addr= self.so[k].recvfrom(data_size)
+            except socket.error, emsg:
+                return sockdata
+
+    def active(self):
+        return any(so is not None for so in self.so)
+
+    def get_servers_input(self):
+        u'''Wait until every connected server has sent its observation.'''
+        pending= set(k for k in range(len(self.so)) if self.so[k])
+        while pending:
+            ready,_,_= select.select([self.so[k] for k in pending], [], [], self.timeout)
+            if not ready:
+                print u'.',
+                continue
+            for k in list(pending):
+                if self.so[k] not in ready: continue
+                sockdata= self.recv_latest(k)
+                if not sockdata or b'***identified***' in sockdata:
+                    continue
+                elif b'***shutdown***' in sockdata or b'***restart***' in sockdata:
+                    print u"Server has stopped the race on %d." % self.ports[k]
+                    self.shutdown(k)
+                else:
+                    self.S[k].parse_server_bytes(sockdata)
+                pending.discard(k)
+
+    def respond_to_servers(self):
+        for k in range(len(self.so)):
+            if self.so[k]:
+                self.so[k].sendto(self.R[k].encode(), (self.host, self.ports[k]))
+
+    def shutdown(self, k=None):
+        for j in (range(len(self.so)) if k is None else [k]):
+            if self.so[j]:
+                self.so[j].close()
+                self.so[j]= None
+
 class ServerState(object):
     u'''What the server is reporting right now.'''
     def __init__(self):
@@ -303,6 +471,10 @@ class ServerState(object):
             w= i.split(u' ')
             self.d[w[0]]= destringify(w[1:])
 
+    def parse_server_bytes(self, data):
+        u'''Parse the raw datagram.'''
+        self.parse_server_str(data.decode(u'utf-8'))
+
     def __repr__(self):
         # Comment the next line for raw output:
         return self.fancyout()
@@ -443,6 +615,143 @@ class ServerState(object):
             out+= u"%s: %s\n" % (k,strout)
         return out
 
+class FastServerState(ServerState):
+    u'''ServerState that decodes the datagram straight into a float32
+    vector laid out as SENSOR_LAYOUT. The "d" dictionary is only built
+    when someone asks for it (debug output, legacy callers).
+    With vision the 64x64 RGB "img" field is cut out of the datagram and
+    decoded straight into the uint8 (3, 64, 64) array self.img.'''
+    separators= string.maketrans(b'()\x00', b'   ')
+    image_shape= (64, 64, 3) # As sent: rows of interleaved RGB pixels.
+
+    def __init__(self, vision=False):
+        self.servstr= unicode()
+        self.vision= vision
+        self.img= np.zeros((3, 64, 64), dtype=np.uint8) # Channels first, like obs_vision_to_image_rgb.
+        self.offsets= SENSOR_OFFSETS
+        self.v= np.zeros(SENSOR_SIZE, dtype=np.float32)
+        self.expected= -1   # Number of tokens in a datagram of the learned format.
+        self.getter= None   # Picks the value tokens in layout order.
+        self.dst= None      # Slots they go to, None when every slot is filled.
+        self._d= None
+        index, scale= [], []
+        for name,k in STATE_LAYOUT:
+            start,n= self.offsets[name]
+            index.extend(range(start, start+n))
+            scale.extend([k]*n)
+        self.state_index= np.array(index)
+        self.state_scale= np.array(scale, dtype=np.float32)
+        self.state_buffer= np.zeros(len(index), dtype=np.float32)
+
+    def learn_format(self, tokens):
+        u'''Work out which token goes to which slot of self.v.'''
+        slots= dict()
+        i= 0
+        while i < len(tokens):
+            name= tokens[i]
+            j= i+1
+            while j < len(tokens) and not tokens[j][:1].isalpha(): j+= 1
+            if name in self.offsets and self.offsets[name][1] == j-i-1:
+                start= self.offsets[name][0]
+                for k in range(j-i-1): slots[start+k]= i+1+k
+            i= j
+        dst= sorted(slots)
+        self.expected= len(tokens)
+        self.getter= operator.itemgetter(*[slots[k] for k in dst])
+        if len(dst) == len(self.v): self.dst= None
+        else: self.dst= np.array(dst)
+
+    def parse_server_bytes(self, data):
+        u'''Parse the raw datagram into self.v (and self.img).'''
+        if self.vision:
+            i= data.find(b'(img ')
+            if i >= 0:
+                j= data.find(b')', i)
+                self.parse_image(data[i+5:j])
+                data= data[:i] + data[j+1:]
+        tokens= data.translate(self.separators).split()
+        if len(tokens) != self.expected:
+            self.learn_format(tokens)
+        # NumPy parses the number strings while filling the vector.
+        if self.dst is None: self.v[:]= self.getter(tokens)
+        else: self.v[self.dst]= self.getter(tokens)
+        self._d= None
+
+    def parse_server_str(self, server_string):
+        self.parse_server_bytes(server_string.encode(u'utf-8'))
+
+    def parse_image(self, data):
+        u'''Decode the space separated pixel values into self.img.'''
+        pixels= np.fromstring(data, dtype=np.uint8, sep=u' ')
+        if pixels.size == self.img.size:
+            np.copyto(self.img, pixels.reshape(self.image_shape).transpose(2, 0, 1))
+
+    def get(self, name):
+        u'''View of one sensor in self.v.'''
+        start,n= self.offsets[name]
+        return self.v[start:start+n]
+
+    def state(self, out=None):
+        u'''The normalized 29-dim agent state, written into out.'''
+        if out is None: out= self.state_buffer
+        np.take(self.v, self.state_index, out=out)
+        out*= self.state_scale
+        return out
+
+    @property
+    def d(self):
+        if self._d is None:
+            self._d= dict()
+            for name,n in SENSOR_LAYOUT:
+                start= self.offsets[name][0]
+                if n == 1: self._d[name]= float(self.v[start])
+                else: self._d[name]= [float(x) for x in self.v[start:start+n]]
+            if self.vision: self._d[u'img']= self.img
+        return self._d
+
+class ActionEncoder(object):
+    u'''Builds the wire message for a DriverAction dictionary in one
+    formatting step. The focus angles practically never change, so they
+    are baked into a cached template that is only rebuilt when they do.
+    The continuous controls are clipped together as one small array.'''
+    controls= (u'accel', u'brake', u'clutch', u'steer')
+    lo= np.array([0., 0., 0., -1.])
+    hi= np.array([1., 1., 1., 1.])
+    gears= (-1, 0, 1, 2, 3, 4, 5, 6)
+
+    def __init__(self):
+        self.values= np.zeros(len(self.controls))
+        self.focus= None
+        self.template= None
+
+    def make_template(self, focus):
+        if type(focus) is not list or min(focus)<-180 or max(focus)>180:
+            self.focus= None
+            focusstr= b'0.000'
+        else:
+            self.focus= list(focus)
+            focusstr= b' '.join([str(x) for x in focus])
+        self.template= (b'(accel %.3f)(brake %.3f)(clutch %.3f)(gear %.3f)(steer %.3f)(focus '
+                        + focusstr.replace(b'%', b'%%') + b')(meta %.3f)')
+
+    def encode(self, d):
+        u'''Clip d to the server limits (in place, like clip_to_limits) and
+        return the message bytes.'''
+        values= self.values
+        values[:]= (d[u'accel'], d[u'brake'], d[u'clutch'], d[u'steer'])
+        np.maximum(values, self.lo, out=values)
+        np.minimum(values, self.hi, out=values)
+        accel, brake, clutch, steer= values.tolist()
+        d[u'accel'], d[u'brake'], d[u'clutch'], d[u'steer']= accel, brake, clutch, steer
+        if d[u'gear'] not in self.gears:
+            d[u'gear']= 0
+        if d[u'meta'] not in (0,1):
+            d[u'meta']= 0
+        if d[u'focus'] != self.focus or self.template is None:
+            self.make_template(d[u'focus'])
+            if self.focus is None: d[u'focus']= 0
+        return self.template % (accel, brake, clutch, d[u'gear'], steer, d[u'meta'])
+
 class DriverAction(object):
     u'''What the driver is intending to do (i.e. send to the server).
     Composes something like this for the server:
@@ -459,6 +768,7 @@ class DriverAction(object):
                    u'focus':[-90,-45,0,45,90],
                     u'meta':0
                     }
+       self.encoder= ActionEncoder()
 
     def clip_to_limits(self):
         u"""There pretty much is never a reason to send the server
@@ -479,19 +789,12 @@ class DriverAction(object):
         if type(self.d[u'focus']) is not list or min(self.d[u'focus'])<-180 or max(self.d[u'focus'])>180:
             self.d[u'focus']= 0
 
+    def encode(self):
+        u'''The message for the server, as bytes.'''
+        return self.encoder.encode(self.d)
+
     def __repr__(self):
-        self.clip_to_limits()
-        out= unicode()
-        for k in self.d:
-            out+= u'('+k+u' '
-            v= self.d[k]
-            if not type(v) is list:
-                out+= u'%.3f' % v
-            else:
-                out+= u' '.join([unicode(x) for x in v])
-            out+= u')'
-        return out
-        return out+u'\n'
+        return self.encode().decode(u'ascii')
 
     def fancyout(self):
         u'''Specialty output for useful monitoring of bot's effectors.'''
@@ -0,0 +1,102 @@
+import numpy as np
+
+from fake_torcs import GEAR_RPM, KinematicTrack
+
+GEAR_SPEEDS = [50, 80, 110, 140, 170]  # [km/h] upshift points of the snakeoil automatic gearbox
+
+
+class SurrogateTorcsEnv(object):
+    # In-process stand-in for VecTorcsEnv: n_envs cars simulated at once by the NumPy
+    # KinematicTrack model instead of TORCS, for pretraining before fine-tuning on the simulator.
+    # States use the 29-dim layout of obs_to_state. The reward and the backward-driving
+    # termination match TorcsEnv.step. Finished cars reset automatically, and their last state
+    # is returned in info like VecTorcsEnv does.
+    # step() returns one of two state buffers that alternate between calls.
+
+    default_speed = 50
+
+    def __init__(self, n_envs, throttle=True, gear_change=False, max_steps=None, seed=None):
+        self.n_envs = n_envs
+        self.throttle = throttle
+        self.gear_change = gear_change
+        self.max_steps = max_steps  # Truncate episodes after this many steps, None never does
+        self.car = KinematicTrack(n=n_envs, seed=seed)
+        self.accel = np.zeros(n_envs)
+        self.time_step = np.zeros(n_envs, dtype=np.int64)
+        self.states = [np.zeros((n_envs, 29), dtype=np.float32) for _ in range(2)]
+        self.state_flip = 0
+        self.empty_info = {}
+
+    def get_state(self):
+        return self.states[self.state_flip]
+
+    def update_state(self, flip=True):
+        if flip:
+            self.state_flip ^= 1
+        state = self.states[self.state_flip]
+        car = self.car
+        speed = car.v * 3.6
+        state[:, 0] = car.angle / 3.1416
+        car.track_sensors(out=state[:, 1:20])
+        state[:, 1:20] /= 200.
+        state[:, 20] = car.track_pos()
+        state[:, 21] = speed / 300.
+        state[:, 22:24] = 0.
+        state[:, 24:28] = (car.v / 0.33 / 100.)[:, None]
+        state[:, 28] = (800. + speed * GEAR_RPM[car.gear.astype(np.int64) + 1]) / 10000.
+        return state
+
+    def reset(self, relaunch=False):
+        self.car.reset()
+        self.accel[:] = 0.
+        self.time_step[:] = 0
+        return self.update_state()
+
+    def step(self, actions):
+        u = np.asarray(actions, dtype=np.float64).reshape(self.n_envs, -1)
+        car = self.car
+        speed = car.v * 3.6
+        steer = u[:, 0]
+
+        if self.throttle:
+            accel, brake = u[:, 1], u[:, 2]
+        else:
+            # Snakeoil automatic throttle and traction control, per car
+            self.accel += np.where(speed < self.default_speed - steer * 50, .01, -.01)
+            np.minimum(self.accel, 0.2, out=self.accel)
+            self.accel += (speed < 10) / (speed + .1)
+            accel, brake = self.accel, 0.
+
+        if self.gear_change:
+            gear = u[:, 3].astype(np.int64)
+        elif self.throttle:
+            gear = 1 + np.searchsorted(GEAR_SPEEDS, speed, side='right')
+        else:
+            gear = 1
+
+        damage_pre = car.damage.copy()
+        car.step(steer, accel, brake, gear)
+
+        # Same reward and termination as TorcsEnv.step
+        sp = car.v * 3.6
+        cos_angle = np.cos(car.angle)
+        rewards = sp * cos_angle - np.abs(sp * np.sin(car.angle)) - sp * np.abs(car.track_pos())
+        rewards[car.damage - damage_pre > 0] = -1
+        dones = cos_angle < 0
+        self.time_step += 1
+        if self.max_steps is not None:
+            dones |= self.time_step >= self.max_steps
+
+        state = self.update_state()
+        infos = [self.empty_info] * self.n_envs
+        if dones.any():
+            for n in np.flatnonzero(dones):
+                infos[n] = {'terminal_state': state[n].copy()}
+            car.reset(dones)
+            self.accel[dones] = 0.
+            self.time_step[dones] = 0
+            state = self.update_state(flip=False)
+        return state, rewards.astype(np.float32), dones, infos
+
+    def end(self):
+        pass
@@ -0,0 +1,16 @@
+import tensorflow as tf
+
+
+def create_target_update_ops(weights, target_weights, TAU):
+    # Soft (TAU blend) and hard (copy) target updates as assign ops, run inside the session
+    soft = [tf.assign(t, TAU * w + (1 - TAU) * t) for w, t in zip(weights, target_weights)]
+    hard = [tf.assign(t, w) for w, t in zip(weights, target_weights)]
+    return tf.group(*soft), tf.group(*hard)
+
+
+def run_target_updates(sess, networks, hard=False):
+    # Soft (or hard copy) target update of every network in one session call
+    if hard:
+        sess.run([network.target_hard_update for network in networks])
+    else:
+        sess.run([network.target_soft_update for network in networks])
@@ -0,0 +1,51 @@
+import sys
+import unittest
+
+import numpy as np
+
+from fake_torcs import FakeTorcsServer
+from gym_torcs import TorcsEnv, obs_to_state
+
+PORT = 3171
+
+
+class TorcsEnvStepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.argv, sys.argv = sys.argv, sys.argv[:1]  # snakeoil3_gym.Client parses the command line
+        self.server = FakeTorcsServer(PORT, seed=0).start()
+        self.env = TorcsEnv(throttle=True, port=PORT, manage_torcs=False)
+
+    def tearDown(self):
+        self.env.client.so.close()
+        self.server.stop()
+        sys.argv = self.argv
+
+    def test_step_reuses_buffers(self):
+        env = self.env
+        env.reset()
+        env.get_state()
+        allocations = env.allocations
+        for _ in range(50):
+            env.step(np.array([0.01, 0.8, 0.]))
+            state = env.get_state()
+            self.assertTrue(any(state is buf for buf in env.state_buffers))
+            for field in env.get_obs():
+                self.assertTrue(np.may_share_memory(field, env.observation_buffer))
+            np.testing.assert_allclose(state, obs_to_state(env.get_obs()), rtol=1e-6)
+        self.assertEqual(env.allocations, allocations)
+
+    def test_states_alternate(self):
+        # s_t must survive the step that writes s_t1
+        env = self.env
+        env.reset()
+        s_t = env.get_state()
+        before = s_t.copy()
+        env.step(np.array([0., 1., 0.]))
+        s_t1 = env.get_state()
+        self.assertIsNot(s_t, s_t1)
+        np.testing.assert_array_equal(s_t, before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import copy
+import unittest
+
+import snakeoil3_gym as snakeoil3
+
+
+def concatenated(action):
+    # The message as DriverAction.__repr__ built it before ActionEncoder
+    action.clip_to_limits()
+    out = u''
+    for k in action.d:
+        out += u'(' + k + u' '
+        v = action.d[k]
+        if not type(v) is list:
+            out += u'%.3f' % v
+        else:
+            out += u' '.join([unicode(x) for x in v])
+        out += u')'
+    return out
+
+
+def parsed(message):
+    # The message read back as the server-side dictionary, datagrams end in a NUL
+    S = snakeoil3.ServerState()
+    S.parse_server_str(message + u'\x00')
+    return S.d
+
+
+class ActionEncoderTest(unittest.TestCase):
+
+    def assertRoundTrip(self, **controls):
+        action = snakeoil3.DriverAction()
+        action.d.update(controls)
+        reference = snakeoil3.DriverAction()
+        reference.d = copy.deepcopy(action.d)
+        message = action.encode().decode(u'ascii')
+        self.assertEqual(parsed(message), parsed(concatenated(reference)))
+        # encode() clips the dictionary in place like clip_to_limits()
+        self.assertEqual(action.d, reference.d)
+        return parsed(message)
+
+    def test_defaults(self):
+        d = self.assertRoundTrip()
+        self.assertEqual(d[u'focus'], [-90, -45, 0, 45, 90])
+
+    def test_clipping(self):
+        d = self.assertRoundTrip(steer=9483.323, accel=-2., brake=3., clutch=1.5)
+        self.assertEqual((d[u'steer'], d[u'accel'], d[u'brake'], d[u'clutch']), (1., 0., 1., 1.))
+        self.assertRoundTrip(steer=-1.7, accel=0.25, brake=0.125)
+
+    def test_invalid_focus(self):
+        self.assertEqual(self.assertRoundTrip(focus=[-200, 0, 45])[u'focus'], 0)
+        self.assertEqual(self.assertRoundTrip(focus=30)[u'focus'], 0)
+
+    def test_focus_change_rebuilds_template(self):
+        action = snakeoil3.DriverAction()
+        action.encode()
+        action.d[u'focus'] = [-10, 0, 10]
+        self.assertEqual(parsed(action.encode().decode(u'ascii'))[u'focus'], [-10, 0, 10])
+        action.d[u'focus'] = 500
+        self.assertEqual(parsed(action.encode().decode(u'ascii'))[u'focus'], 0)
+
+    def test_gear_and_meta(self):
+        self.assertEqual(self.assertRoundTrip(gear=-1)[u'gear'], -1)
+        self.assertEqual(self.assertRoundTrip(gear=9)[u'gear'], 0)
+        self.assertEqual(self.assertRoundTrip(meta=1)[u'meta'], 1)
+        self.assertEqual(self.assertRoundTrip(meta=5)[u'meta'], 0)
+
+    def test_repr(self):
+        action = snakeoil3.DriverAction()
+        self.assertEqual(repr(action), action.encode().decode(u'ascii'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import errno
+import os
+import signal
+import sys
+import unittest
+
+from torcs_supervisor import TorcsSupervisor, probe
+
+PORT = 3172
+FAKE_TORCS = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_torcs.py'),
+              '--port', str(PORT)]
+
+
+def group_exists(pgid):
+    try:
+        os.killpg(pgid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+class TorcsSupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = TorcsSupervisor(FAKE_TORCS, port=PORT, autostart=None, max_rss=None, probe_interval=0.1)
+        self.supervisor.launch()
+
+    def tearDown(self):
+        self.supervisor.close()
+
+    def test_launch_answers_probe(self):
+        self.assertTrue(self.supervisor.alive())
+        self.assertTrue(probe(PORT))
+        self.assertIsNone(self.supervisor.check())
+        metrics = self.supervisor.metrics()
+        self.assertEqual((metrics['launches'], metrics['relaunches']), (1, 0))
+        self.assertGreater(metrics['restart_latency'], 0.)
+
+    def test_memory_relaunch(self):
+        pid = self.supervisor.process.pid
+        self.supervisor.max_rss = 1
+        self.assertEqual(self.supervisor.check(), 'memory')
+        self.assertNotEqual(self.supervisor.process.pid, pid)
+        self.assertFalse(group_exists(pid))
+        self.assertGreater(self.supervisor.metrics()['rss'], 1)
+        self.supervisor.max_rss = None
+        self.assertTrue(probe(PORT))
+
+    def test_dead_relaunch(self):
+        os.killpg(self.supervisor.process.pid, signal.SIGKILL)
+        self.supervisor.process.wait()
+        self.assertEqual(self.supervisor.check(), 'dead')
+        self.assertTrue(probe(PORT))
+
+    def test_metrics_count_relaunches(self):
+        self.supervisor.max_rss = 1
+        self.supervisor.check()
+        self.supervisor.max_rss = None
+        os.killpg(self.supervisor.process.pid, signal.SIGKILL)
+        self.supervisor.process.wait()
+        self.supervisor.check()
+        self.supervisor.relaunch()
+        metrics = self.supervisor.metrics()
+        self.assertEqual(metrics['launches'], 4)
+        self.assertEqual(metrics['relaunches'], 3)
+        self.assertEqual((metrics['relaunches_memory'], metrics['relaunches_dead'],
+                          metrics['relaunches_requested'], metrics['relaunches_unresponsive']), (1, 1, 1, 0))
+        self.assertGreater(metrics['mean_restart_latency'], 0.)
+
+    def test_close_leaves_no_process(self):
+        pid = self.supervisor.process.pid
+        self.supervisor.close()
+        self.assertFalse(self.supervisor.alive())
+        self.assertFalse(group_exists(pid))
+        self.assertFalse(probe(PORT, timeout=0.2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import signal
+import socket
+import subprocess
+import time
+
+from snakeoil3_gym import TRACK_ANGLES
+
+TORCS_COMMAND = ['torcs', '-nofuel', '-nolaptime']
+VISION_COMMAND = ['torcs', '-nofuel', '-nodamage', '-nolaptime', '-vision']
+AUTOSTART_COMMAND = ['sh', 'autostart.sh']  # Drives the TORCS menus into the race with xte
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def process_tree_rss(pid):
+    # Resident memory in bytes of pid and all of its descendants, read from /proc
+    children, rss = {}, {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (IOError, OSError, IndexError):
+            continue  # The process exited while we were looking
+        child = int(entry)
+        children.setdefault(int(fields[1]), []).append(child)
+        rss[child] = int(fields[21]) * PAGE_SIZE
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        total += rss.get(p, 0)
+        stack.extend(children.get(p, []))
+    return total
+
+
+def probe(port, host='localhost', timeout=0.5, sid='SCR'):
+    # True when an SCR server on port answers the identification handshake. The race this
+    # starts is restarted right away, so the next client can identify like after a reset.
+    so = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    so.settimeout(timeout)
+    try:
+        so.sendto(('%s(init %s)' % (sid, TRACK_ANGLES)).encode('ascii'), (host, port))
+        data, _ = so.recvfrom(2 ** 17)
+        if b'***identified***' not in data:
+            return False
+        so.sendto(b'(meta 1)', (host, port))
+        return True
+    except socket.error:
+        return False
+    finally:
+        so.close()
+
+
+class TorcsSupervisor(object):
+    # Owns one simulator child process, in its own process group so that stopping it never
+    # touches other simulators on the host. The simulator counts as ready once it answers the
+    # UDP handshake. It is relaunched only when it died, when the RSS of its process tree passes
+    # max_rss (TORCS leaks memory across restarts) or when a client reports it unresponsive.
+    # Works with any command serving SCR on port, e.g. ['python', 'fake_torcs.py', '--port', '3101'].
+
+    def __init__(self, command=TORCS_COMMAND, port=3101, host='localhost', autostart=AUTOSTART_COMMAND,
+                 max_rss=2 * 1024 ** 3, ready_timeout=30., probe_interval=0.25, autostart_delay=0.5, attempts=3):
+        self.command = command
+        self.port = port
+        self.host = host
+        self.autostart = autostart
+        self.max_rss = max_rss
+        self.ready_timeout = ready_timeout
+        self.probe_interval = probe_interval
+        self.autostart_delay = autostart_delay
+        self.attempts = attempts
+        self.process = None
+        self.devnull = open(os.devnull, 'w')
+
+        # Metrics
+        self.launches = 0
+        self.relaunches = {'dead': 0, 'memory': 0, 'unresponsive': 0, 'requested': 0}
+        self.restart_latency = 0.  # [s] from launch to the first answered handshake
+        self.total_restart_latency = 0.
+        self.last_rss = 0
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def rss(self):
+        self.last_rss = process_tree_rss(self.process.pid) if self.alive() else 0
+        return self.last_rss
+
+    def launch(self):
+        for _ in range(self.attempts):
+            start = time.time()
+            self.process = subprocess.Popen(self.command, stdout=self.devnull, stderr=self.devnull,
+                                            preexec_fn=os.setsid)
+            if self.autostart:
+                time.sleep(self.autostart_delay)
+                subprocess.call(self.autostart, stdout=self.devnull, stderr=self.devnull)
+            if self.wait_ready(start + self.ready_timeout):
+                self.launches += 1
+                self.restart_latency = time.time() - start
+                self.total_restart_latency += self.restart_latency
+                return self.restart_latency
+            self.kill()
+        raise RuntimeError("Simulator on port %d not ready after %d launches" % (self.port, self.attempts))
+
+    def wait_ready(self, deadline):
+        while time.time() < deadline and self.alive():
+            start = time.time()
+            if probe(self.port, self.host, timeout=self.probe_interval):
+                return True
+            # A closed port is refused at once, keep probing at the same pace
+            time.sleep(max(0., self.probe_interval - (time.time() - start)))
+        return False
+
+    def kill(self, timeout=5.):
+        if not self.alive():
+            self.process = None
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+            deadline = time.time() + timeout
+            while self.process.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if self.process.poll() is None:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+        except OSError:
+            pass  # Already gone
+        self.process = None
+
+    def relaunch(self, reason='requested'):
+        self.relaunches[reason] += 1
+        self.kill()
+        return self.launch()
+
+    def unresponsive(self):
+        # Called by a client whose handshake keeps timing out
+        self.relaunch('unresponsive')
+
+    def check(self):
+        # Relaunch if the simulator died or grew past max_rss. Call between episodes.
+        # Returns the reason of the relaunch, None when the simulator was kept.
+        if not self.alive():
+            reason = 'dead'
+        elif self.max_rss and self.rss() > self.max_rss:
+            reason = 'memory'
+        else:
+            return None
+        self.relaunch(reason)
+        return reason
+
+    def metrics(self):
+        relaunches = sum(self.relaunches.values())
+        metrics = {'launches': self.launches, 'relaunches': relaunches,
+                   'restart_latency': self.restart_latency,
+                   'mean_restart_latency': self.total_restart_latency / max(self.launches, 1),
+                   'rss': self.last_rss}
+        for reason, count in self.relaunches.items():
+            metrics['relaunches_' + reason] = count
+        return metrics
+
+    def close(self):
+        self.kill()
+        self.devnull.close()
@@ -0,0 +1,70 @@
+import multiprocessing as mp
+import numpy as np
+
+from gym_torcs import TorcsEnv
+
+
+def worker(remote, port, env_kwargs):
+    env = TorcsEnv(port=port, **env_kwargs)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                ob, reward, done, info = env.step(data)
+                state = env.get_state()
+                if done:
+                    # Auto-reset, the last state of the finished episode travels in info
+                    info = {'terminal_state': state}
+                    env.reset()
+                    state = env.get_state()
+                remote.send((state, reward, done, info))
+            elif cmd == 'reset':
+                env.reset(relaunch=data)
+                remote.send(env.get_state())
+            elif cmd == 'close':
+                env.end()
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remote.close()
+
+
+class VecTorcsEnv(object):
+    # N TorcsEnv workers in subprocesses, one simulator each on ports base_port, base_port+1, ...
+    # The simulators are expected to be running already (the workers do not pkill/launch TORCS).
+    # States come back stacked as (n_envs, 29) arrays and finished episodes reset automatically.
+
+    def __init__(self, n_envs, base_port=3101, vision=False, throttle=False, gear_change=False):
+        if vision:
+            raise ValueError("VecTorcsEnv only supports the low-dimensional state")
+        self.n_envs = n_envs
+        env_kwargs = dict(vision=vision, throttle=throttle, gear_change=gear_change, manage_torcs=False)
+        self.remotes, self.processes = [], []
+        for i in range(n_envs):
+            remote, worker_remote = mp.Pipe()
+            process = mp.Process(target=worker, args=(worker_remote, base_port + i, env_kwargs))
+            process.daemon = True
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+    def reset(self, relaunch=False):
+        for remote in self.remotes:
+            remote.send(('reset', relaunch))
+        return np.stack([remote.recv() for remote in self.remotes])
+
+    def step(self, actions):
+        # Send every action before waiting, so all simulators tick concurrently
+        for remote, action in zip(self.remotes, actions):
+            remote.send(('step', action))
+        results = [remote.recv() for remote in self.remotes]
+        states, rewards, dones, infos = zip(*results)
+        return np.stack(states), np.array(rewards, dtype=np.float32), np.array(dones, dtype=np.bool_), list(infos)
+
+    def end(self):
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()